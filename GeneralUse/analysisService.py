@@ -0,0 +1,222 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import types
+import typing
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from batch import AnalysisPool, analyze_file, exit_on_sigterm, future_result
+from serviceClient import DEFAULT_HOST, DEFAULT_PORT, FINISHED_STATES
+
+# Long-lived local analysis service. The worker processes are started once and forked from
+# a process that has already imported pandas, NumPy and the analyzer, and every job shares
+# one parsed-input cache, so a small plate file costs its analysis and not the startup.
+# Jobs are the arguments of batch.analyze_file as JSON and run on a bounded process pool;
+# the reply is the same summary batch prints, with the output path. It only listens on the
+# loopback interface and needs no network. See serviceClient.py for the client.
+#
+#   POST /jobs              queue a job, returns its status
+#   GET  /jobs/<id>?wait=s  status of a job, held up to s seconds until it finishes
+#   GET  /jobs              status of every job still kept
+#   GET  /health            worker count and queue length
+
+# the GUI's parsed-input cache, so runs opened in the GUI are already parsed
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".dataAnalyzer_cache", "GeneralUse")
+# analyze_file arguments the service sets itself
+SERVICE_ARGUMENTS = ("cache_dir",)
+
+# whether a value decoded from JSON fits a parameter annotation of analyze_file
+def matches_annotation(value, annotation) -> bool:
+    if annotation is inspect.Parameter.empty:
+        return True
+    if annotation is None or annotation is type(None):
+        return value is None
+    origin = typing.get_origin(annotation)
+    if origin in (types.UnionType, typing.Union):
+        return any(matches_annotation(value, option) for option in typing.get_args(annotation))
+    if origin is list:
+        item, = typing.get_args(annotation)
+        return isinstance(value, list) and all(matches_annotation(v, item) for v in value)
+    # JSON true and false are not numbers here, and a float parameter takes whole numbers
+    if annotation in (int, float) and isinstance(value, bool):
+        return False
+    if annotation is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, annotation)
+
+class AnalysisService:
+
+    def __init__(self, workers: int | None = None, cache_dir: str | None = DEFAULT_CACHE_DIR,
+                 keep_finished: int = 1000):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = AnalysisPool(self.workers)
+        self.cache_dir = cache_dir
+        # finished jobs kept for status queries, the oldest are forgotten first
+        self.keep_finished = keep_finished
+        self.jobs: dict[int, dict] = {}
+        self.futures: dict[int, Future] = {}
+        self.finished_events: dict[int, threading.Event] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, job: dict) -> dict:
+        arguments = dict(job)
+        reserved = [name for name in SERVICE_ARGUMENTS if name in arguments]
+        if reserved:
+            raise ValueError(f"{', '.join(reserved)} is set by the service")
+        signature = inspect.signature(analyze_file)
+        try:
+            signature.bind(**arguments)
+        except TypeError as e:
+            raise ValueError(f"bad job: {e}") from None
+        for name, value in arguments.items():
+            if not matches_annotation(value, signature.parameters[name].annotation):
+                raise ValueError(f"bad job: {name} cannot be {value!r}")
+        arguments["cache_dir"] = self.cache_dir
+        if arguments.get("output_dir"):
+            try:
+                os.makedirs(arguments["output_dir"], exist_ok=True)
+            except OSError as e:
+                raise ValueError(f"cannot create output_dir: {e}") from None
+
+        with self.lock:
+            job_id = next(self.ids)
+            self.jobs[job_id] = {"id": job_id, "state": "queued", "job": job, "submitted": time.time(),
+                                 "finished": None, "result": None}
+            self.finished_events[job_id] = threading.Event()
+            self.futures[job_id] = self.pool.submit(**arguments)
+        self.futures[job_id].add_done_callback(lambda future: self._finish(job_id, future))
+        return self.status(job_id)
+
+    def _finish(self, job_id: int, future: Future) -> None:
+        result = future_result(future, self.jobs[job_id]["job"].get("filepath"))
+        with self.lock:
+            self.jobs[job_id].update(state="done" if result["error"] is None else "failed",
+                                     finished=time.time(), result=result)
+            del self.futures[job_id]
+            finished = self.finished_events[job_id]
+            self._forget_finished()
+        finished.set()
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job["state"] in FINISHED_STATES]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self.jobs[job_id]
+            del self.finished_events[job_id]
+
+    # KeyError for a job that is unknown or was forgotten
+    def status(self, job_id: int, wait: float = 0) -> dict:
+        with self.lock:
+            finished = self.finished_events[job_id]
+        if wait > 0:
+            finished.wait(wait)
+        with self.lock:
+            return self._snapshot(job_id)
+
+    def list_jobs(self) -> list[dict]:
+        with self.lock:
+            return [self._snapshot(job_id) for job_id in self.jobs]
+
+    # a copy of the job's entry, called with the lock held
+    def _snapshot(self, job_id: int) -> dict:
+        job = dict(self.jobs[job_id])
+        future = self.futures.get(job_id)
+        if job["state"] == "queued" and future is not None and future.running():
+            job["state"] = "running"
+        return job
+
+    def health(self) -> dict:
+        with self.lock:
+            pending = len(self.futures)
+        return {"ok": True, "workers": self.workers, "pending": pending, "cache_dir": self.cache_dir}
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    @property
+    def service(self) -> AnalysisService:
+        return self.server.service
+
+    def _reply(self, code: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts == ["health"]:
+            self._reply(200, self.service.health())
+        elif parts == ["jobs"]:
+            self._reply(200, {"jobs": self.service.list_jobs()})
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            try:
+                wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+                self._reply(200, self.service.status(int(parts[1]), wait))
+            except ValueError:
+                self._reply(400, {"error": "wait must be a number of seconds"})
+            except KeyError:
+                self._reply(404, {"error": f"no job {parts[1]}"})
+        else:
+            self._reply(404, {"error": f"no such resource {url.path}"})
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path.strip("/") != "jobs":
+            self._reply(404, {"error": f"no such resource {self.path}"})
+            return
+        # Browsers send text/plain and form posts from any web page without asking first,
+        # only a JSON body shows the job came from a client that was allowed to send it
+        if self.headers.get_content_type() != "application/json":
+            self._reply(415, {"error": "jobs must be sent as application/json"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(job, dict):
+                raise ValueError("a job is a JSON object")
+            self._reply(202, self.service.submit(job))
+        except (ValueError, TypeError, OSError) as e:
+            self._reply(400, {"error": str(e)})
+
+    # one line per request only with --verbose
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the analysis as a local service that takes jobs over HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: loopback only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="parsed-input cache directory")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(args.workers, args.cache_dir)
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    server.service = service
+    server.verbose = args.verbose
+    exit_on_sigterm()
+    print(f"analysis service on http://{args.host}:{server.server_port} with {service.workers} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
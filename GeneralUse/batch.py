@@ -0,0 +1,197 @@
+import argparse
+import glob
+import hashlib
+import os
+import shutil
+import signal
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataAnalyzer import DataAnalyzer, convert_to_trace_store
+from inputCache import InputCache
+from outputWriters import OUTPUT_WRITERS
+from resultsStore import ResultsStore
+from stageReport import StageReport
+from traceStore import is_trace_store
+
+INPUT_EXTENSIONS = (".xlsx", ".csv")
+# names analyze_file gives its outputs, skipped when outputs sit next to the inputs
+OUTPUT_SUFFIXES = ("_results", "_results_wells")
+
+# run files an instrument exports, leaving out lock files, hidden files and our own outputs
+def is_input_file(name: str) -> bool:
+    stem, extension = os.path.splitext(name)
+    # "~$" files are Excel's lock files
+    return (extension.lower() in INPUT_EXTENSIONS and not name.startswith(("~$", "."))
+            and not stem.endswith(OUTPUT_SUFFIXES))
+
+# input files from a mix of file paths, directories, trace stores and glob patterns, in a stable order.
+# Directories and patterns only give input files; a file named outright is always taken.
+def collect_inputs(patterns: list[str]) -> list[str]:
+    files = []
+    for pattern in patterns:
+        if is_trace_store(pattern):
+            matches = [pattern]
+        elif os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in sorted(os.listdir(pattern)) if is_input_file(name)]
+        elif glob.has_magic(pattern):
+            matches = [match for match in sorted(glob.glob(pattern))
+                       if is_trace_store(match) or is_input_file(os.path.basename(match))]
+        else:
+            matches = sorted(glob.glob(pattern))
+        files.extend(match for match in matches if match not in files)
+    return files
+
+# where analyze_file writes the output of filepath
+def output_path(filepath: str, output_dir: str | None, output_format: str = "xlsx") -> str:
+    output_dir = output_dir or os.path.dirname(os.path.abspath(filepath))
+    stem = os.path.splitext(os.path.basename(os.path.normpath(filepath)))[0]
+    return os.path.join(output_dir, stem + "_results" + OUTPUT_WRITERS[output_format][1])
+
+# Trace store of filepath in store_dir, named after the file's absolute path so inputs with the
+# same name in different folders never share (and keep rewriting) one store
+def trace_store_path(filepath: str, store_dir: str) -> str:
+    path = os.path.abspath(filepath)
+    digest = hashlib.blake2b(path.encode(), digest_size=8).hexdigest()
+    return os.path.join(store_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{digest}.trace")
+
+# analyze one file and report how it went. Runs in a worker process, so every
+# error is caught and returned instead of stopping the batch.
+def analyze_file(filepath: str, marker_present: bool, num_rows: int, num_cols: int, num_droplets: int,
+                 output_dir: str | None = None, output_format: str = "xlsx", chunk_size: int | None = None,
+                 cache_dir: str | None = None, report: bool = False, intensity_dtype: str = "float64",
+                 store_dir: str | None = None, results_db: str | None = None) -> dict:
+    start = time.perf_counter()
+    output_dir, output_filename = os.path.split(output_path(filepath, output_dir, output_format))
+    result = {"file": filepath, "output": os.path.join(output_dir, output_filename),
+              "peaks": None, "irregulars": None, "error": None}
+    results = None
+    new_store = None
+    try:
+        da = DataAnalyzer(cache=InputCache(cache_dir) if cache_dir else None, intensity_dtype=intensity_dtype)
+        stage_report = StageReport() if report else None
+        if store_dir and not is_trace_store(filepath):
+            # parsed once into a trace store, later batches map it instead of parsing
+            store = trace_store_path(filepath, store_dir)
+            if not is_trace_store(store):
+                new_store = store
+            filepath = convert_to_trace_store(filepath, store, intensity_dtype=intensity_dtype)
+        results = ResultsStore(results_db) if results_db else None
+        da.run_all(filepath, marker_present, num_rows, num_cols, num_droplets, output_dir, output_filename,
+                   output_format, chunk_size, report=stage_report, results=results)
+        result["peaks"] = len(da.peaks)
+        result["irregulars"] = da.potential_merged.size + da.potential_split.size
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        if new_store:
+            # an input that cannot be analyzed leaves no store behind
+            shutil.rmtree(new_store, ignore_errors=True)
+    finally:
+        if results is not None:
+            results.close()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+# run every file on a process pool, results come back in input order
+def run_batch(files: list[str], workers: int | None = None, **kwargs) -> list[dict]:
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyze_file, filepath, **kwargs): filepath for filepath in files}
+        for future in as_completed(futures):
+            filepath = futures[future]
+            results[filepath] = future_result(future, filepath)
+    return [results[filepath] for filepath in files]
+
+# analyze_file's result from a finished future, or a failed result when the worker process itself died
+def future_result(future: Future, filepath: str) -> dict:
+    try:
+        return future.result()
+    except Exception as e:
+        return {"file": filepath, "output": None, "peaks": None, "irregulars": None,
+                "error": f"{type(e).__name__}: {e}", "seconds": 0.0}
+
+# Process pool for analyze_file in processes that run for days (the service and the folder
+# watcher). A worker that dies breaks a ProcessPoolExecutor for good, so the next file
+# submitted starts a new pool instead of failing.
+class AnalysisPool:
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, **arguments) -> Future:
+        try:
+            return self.executor.submit(analyze_file, **arguments)
+        except BrokenProcessPool:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor.submit(analyze_file, **arguments)
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+# Lets a service manager's SIGTERM stop the process cleanly: SystemExit unwinds the finally
+# blocks as Ctrl+C does. Forked workers inherit it and exit quietly when their pool stops them.
+def exit_on_sigterm() -> None:
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+def print_summary(results: list[dict], total_seconds: float) -> None:
+    width = max([len("file")] + [len(os.path.basename(r["file"])) for r in results])
+    print(f"{'file':<{width}}  {'status':<6}  {'seconds':>8}  {'peaks':>8}  {'irregular':>9}")
+    for r in results:
+        status = "ok" if r["error"] is None else "FAILED"
+        peaks = "" if r["peaks"] is None else r["peaks"]
+        irregulars = "" if r["irregulars"] is None else r["irregulars"]
+        print(f"{os.path.basename(r['file']):<{width}}  {status:<6}  {r['seconds']:>8.2f}  {peaks:>8}  {irregulars:>9}")
+    failed = [r for r in results if r["error"] is not None]
+    print(f"{len(results) - len(failed)} of {len(results)} files analyzed in {total_seconds:.2f} s")
+    for r in failed:
+        print(f"{r['file']}: {r['error']}", file=sys.stderr)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze many run files without the GUI, one output per input.")
+    parser.add_argument("inputs", nargs="+", help="input files, directories of .xlsx and .csv files, or glob patterns")
+    parser.add_argument("--rows", type=int, required=True, help="number of rows on the plate")
+    parser.add_argument("--cols", type=int, required=True, help="number of columns on the plate")
+    parser.add_argument("--droplets", type=int, required=True, help="droplets per sample")
+    parser.add_argument("--marker", action="store_true", help="the runs have a marker channel")
+    parser.add_argument("--output-dir", help="folder for the outputs (default: next to each input)")
+    parser.add_argument("--format", choices=list(OUTPUT_WRITERS), default="xlsx", help="output format")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="stream inputs in chunks of this many rows")
+    parser.add_argument("--cache-dir", default=None, help="parsed-input cache directory")
+    parser.add_argument("--report", action="store_true",
+                        help="write per-stage timing and memory next to each output (.stages.json)")
+    parser.add_argument("--float32", action="store_true",
+                        help="store intensities as float32, halving their memory at a small loss of precision")
+    parser.add_argument("--store-dir", default=None,
+                        help="convert each input once into a memory-mapped trace store in this directory and analyze that")
+    parser.add_argument("--results-db", default=None,
+                        help="also add every run's peaks to this SQLite results store for queries across runs")
+    args = parser.parse_args(argv)
+
+    files = collect_inputs(args.inputs)
+    if not files:
+        parser.error("no input files found")
+    outputs = {}
+    for filepath in files:
+        output = os.path.abspath(output_path(filepath, args.output_dir, args.format))
+        if output in outputs:
+            parser.error(f"{outputs[output]} and {filepath} would both be written to {output}")
+        outputs[output] = filepath
+    for folder in (args.output_dir, args.store_dir):
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    start = time.perf_counter()
+    results = run_batch(files, args.workers, output_dir=args.output_dir, marker_present=args.marker,
+                        num_rows=args.rows, num_cols=args.cols, num_droplets=args.droplets,
+                        output_format=args.format, chunk_size=args.chunk_size, cache_dir=args.cache_dir,
+                        report=args.report, intensity_dtype="float32" if args.float32 else "float64",
+                        store_dir=args.store_dir, results_db=args.results_db)
+    print_summary(results, time.perf_counter() - start)
+    return 1 if any(r["error"] is not None for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
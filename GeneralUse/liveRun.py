@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import csv
+import io
+import os
+from dataAnalyzer import (PeakDetector, PeakTable, WalkState, flag_irregulars, heatmap_cube, is_input_column,
+                          row_label, walk_positions)
+
+
+# Follows a CSV export the instrument is still writing. Each call returns only the
+# complete rows added since the last one; a half written last line waits for the next call.
+class CsvTail:
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.offset = 0
+        self.header: list[str] | None = None
+        self.partial = b""
+
+    def read_new(self, max_bytes: int = 16 * 1024 ** 2) -> dict[str, np.ndarray] | None:
+        if os.path.getsize(self.filepath) < self.offset:
+            raise ValueError(f"{self.filepath} got shorter, it is not the same run any more")
+        with open(self.filepath, 'rb') as f:
+            f.seek(self.offset)
+            data = self.partial + f.read(max_bytes)
+        self.offset += len(data) - len(self.partial)
+        complete = data.rfind(b"\n") + 1
+        self.partial = data[complete:]
+        data = data[:complete]
+
+        if self.header is None:
+            line_end = data.find(b"\n")
+            if line_end < 0:
+                self.partial = data + self.partial
+                return None
+            self.header = [col.strip() for col in next(csv.reader([data[:line_end].decode()]))]
+            data = data[line_end + 1:]
+        if not data.strip():
+            return None
+        chunk = pd.read_csv(io.BytesIO(data), header=None, names=self.header, usecols=is_input_column)
+        return {col: chunk[col].to_numpy(dtype=np.float64) for col in chunk.columns}
+
+# Peaks, wells and heatmap of a run that is still being acquired. Each poll() reads only
+# the rows added since the last one, so its cost follows the new data and not the file.
+# The IS and Marker means are taken from the first warmup_samples samples, so results can
+# differ slightly from a full analysis once the run is complete.
+class LiveRun:
+
+    def __init__(self, filepath: str, marker_present: bool, num_rows: int, num_cols: int, num_droplets: int,
+                 iso_name: str | None = None, warmup_samples: int = 5000):
+        if not filepath.lower().endswith(".csv"):
+            raise ValueError("live mode follows a .csv export")
+        self.tail = CsvTail(filepath)
+        self.marker_present = marker_present
+        self.iso_name = iso_name
+        self.warmup_samples = warmup_samples
+        self.num_droplets = num_droplets
+        self.warmup: list[dict[str, np.ndarray]] = []
+        self.detector: PeakDetector | None = None
+        self.tables: list[PeakTable] = []
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        # where the well walk of the peaks so far ended, see walk_positions
+        self.walk: WalkState | None = None
+        self.num_peaks = 0
+        # (row, well number) of the newest peak, labelled only by summary()
+        self.last_position: tuple[int, int] | None = None
+        self.num_samples = 0
+        self.num_merged = 0
+        self.num_split = 0
+        # the newest peaks of one plate, oldest first, drawn the way create_heatmap_cube draws them
+        self.recent = np.empty(0)
+        # laid out like create_heatmap_array, one column per plate row
+        self.heatmap = np.zeros((num_cols, num_rows))
+
+    # read what was added to the file, returns the number of new peaks
+    def poll(self) -> int:
+        chunk = self.tail.read_new()
+        if chunk is None:
+            return 0
+        self.num_samples += chunk['Time (min)'].size
+        if self.detector is None:
+            self.warmup.append(chunk)
+            if self.num_samples < self.warmup_samples:
+                return 0
+            chunk = {col: np.concatenate([c[col] for c in self.warmup]) for col in chunk}
+            self.warmup = []
+            marker_mean = np.nanmean(chunk['Marker']) if self.marker_present else None
+            isomer_columns = [col for col in chunk if col.startswith("Isomer")]
+            if self.iso_name is None and isomer_columns:
+                # no isomer picked, draw the first one
+                self.iso_name = isomer_columns[0]
+            if self.iso_name not in isomer_columns:
+                raise ValueError(f"{self.iso_name} is not a column of {self.tail.filepath}")
+            self.detector = PeakDetector(np.nanmean(chunk['IS']), marker_mean, self.marker_present, isomer_columns)
+        peaks = self.detector.feed(chunk)
+        self.add_peaks(peaks)
+        return len(peaks)
+
+    def add_peaks(self, peaks: PeakTable) -> None:
+        if not len(peaks):
+            return
+        self.tables.append(peaks)
+
+        # flagged against the mean duration so far, the full analysis uses the mean of the whole run
+        mean_duration = self.detector.total_duration / self.detector.num_durations
+        merged, split = flag_irregulars(peaks.duration, mean_duration)
+        self.num_merged += int(np.count_nonzero(merged))
+        self.num_split += int(np.count_nonzero(split))
+
+        rows, well_numbers, self.walk = walk_positions(peaks.is_start_of_row, self.num_rows, self.num_cols,
+                                                       self.num_droplets, self.walk)
+        self.num_peaks += len(peaks)
+        self.last_position = (int(rows[-1]), int(well_numbers[-1]))
+
+        plate_peaks = self.num_rows * self.num_cols * self.num_droplets
+        self.recent = np.concatenate((self.recent, peaks.isomer(self.iso_name)))[-plate_peaks:]
+        self.heatmap = heatmap_cube(self.recent[:, None], self.num_rows, self.num_cols, self.num_droplets)[:, :, 0].T
+
+    def peak_table(self) -> PeakTable:
+        return PeakTable.concat(self.tables, self.detector.isomer_columns if self.detector else [])
+
+    def summary(self) -> str:
+        if self.detector is None:
+            return f"live: waiting for {self.warmup_samples} samples ({self.num_samples} so far)"
+        last_well = row_label(self.last_position[0]) + str(self.last_position[1]) if self.last_position else '-'
+        return (f"live: {self.num_samples} samples, {self.num_peaks} peaks, last well {last_well}, "
+                f"{self.num_merged} possibly merged, {self.num_split} possibly split")
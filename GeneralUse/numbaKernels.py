@@ -0,0 +1,87 @@
+import importlib.util
+import numpy as np
+
+# Compiled versions of the loops that cannot be written as whole array operations, used by
+# the "numba" engine. numba is optional; without it AVAILABLE is False and DataAnalyzer
+# falls back to the numpy engine. numba itself is only imported when a kernel is first
+# called, so importing the analyzer does not pay for it.
+AVAILABLE = importlib.util.find_spec("numba") is not None
+
+# Compiled on first call; compiled code is cached next to this file, so only the first run
+# on a machine compiles. Without numba the plain Python function runs.
+def _jit(fn):
+    kernel = None
+
+    def run(*args):
+        nonlocal kernel
+        if kernel is None:
+            if AVAILABLE:
+                import numba
+                kernel = numba.njit(cache=True, nogil=True)(fn)
+            else:
+                kernel = fn
+        return kernel(*args)
+    return run
+
+# Same peaks as find_peak_bounds and the legacy loop: sample 0 is never looked at and a peak
+# still open at the last sample is dropped. values is a tuple of equal length columns; the
+# mean of each over every peak comes back as one row per column. A first pass counts the
+# peaks so the results are allocated once at their final size.
+@_jit
+def peak_means(time, int_stand, threshold, values):
+    num_samples = int_stand.size
+    num_peaks = 0
+    prev_above = False
+    for i in range(1, num_samples):
+        above = int_stand[i] > threshold
+        if prev_above and not above:
+            num_peaks += 1
+        prev_above = above
+
+    num_values = len(values)
+    durations = np.empty(num_peaks)
+    peak_centers = np.empty(num_peaks)
+    means = np.empty((num_values, num_peaks))
+    sums = np.zeros(num_values)
+    peak = 0
+    start = 0
+    prev_above = False
+    for i in range(1, num_samples):
+        above = int_stand[i] > threshold
+        if above:
+            if not prev_above:
+                start = i
+                sums[:] = 0.0
+            for j in range(num_values):
+                sums[j] += values[j][i]
+        elif prev_above:
+            end = i - 1
+            count = end - start + 1
+            durations[peak] = time[end] - time[start]
+            peak_centers[peak] = (time[end] + time[start]) / 2
+            for j in range(num_values):
+                means[j, peak] = sums[j] / count
+            peak += 1
+        prev_above = above
+    return durations, peak_centers, means
+
+# the create_well_list walk: (row, well number) of every peak
+@_jit
+def walk_wells(is_start_of_row, num_rows, num_cols, num_droplets):
+    num_peaks = is_start_of_row.size
+    rows = np.empty(num_peaks, dtype=np.int64)
+    well_numbers = np.empty(num_peaks, dtype=np.int64)
+    row = num_rows - 1
+    well_number = num_cols
+    prev_start_of_row = False
+    for i in range(num_peaks):
+        start_of_row = is_start_of_row[i]
+        if i > 0 and start_of_row and not prev_start_of_row:
+            row = (row - 1) % num_rows
+            well_number = num_cols
+        elif i % num_droplets == 0 and i != 0:
+            well_number -= 1
+        rows[i] = row
+        well_numbers[i] = well_number
+        prev_start_of_row = start_of_row
+    return rows, well_numbers
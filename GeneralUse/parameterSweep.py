@@ -0,0 +1,140 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from dataAnalyzer import (MERGE_FACTOR, SPLIT_FACTOR, THRESHOLD_FRACTION, DataAnalyzer, attach_columns,
+                          find_peak_bounds, share_columns, sum_over_peaks)
+from inputCache import InputCache
+
+# Peak and irregular counts of one run over a grid of detection settings, for choosing the
+# threshold and the merged/split cutoffs for a new instrument or plate layout. The input is
+# parsed once and shared with the workers once; each worker takes whole threshold fractions,
+# finds the peaks once per fraction, and counts the irregulars of every merge and split
+# factor from the sorted peak durations, so the factor grid costs next to nothing.
+
+SWEEP_COLUMNS = ['threshold_fraction', 'merge_factor', 'split_factor', 'peaks', 'potential_merged',
+                 'potential_split', 'expected_droplets', 'difference', 'marker_rows']
+DEFAULT_FRACTIONS = (0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.5)
+DEFAULT_MERGE_FACTORS = (1.3, 1.4, 1.5, 1.6, 1.8)
+DEFAULT_SPLIT_FACTORS = (0.45, 0.5, 0.55, 0.6, 0.7)
+
+# Sweep rows of one trace: the peaks of every threshold fraction, then the irregulars of
+# every merge and split factor against their mean duration, flagged as find_irregulars
+# flags them. marker_rows counts the runs of row-start peaks, None without a marker.
+def sweep_trace(time: np.ndarray, int_stand: np.ndarray, marker: np.ndarray | None, fractions: list[float],
+                int_stand_mean: float, marker_mean: float | None, merge_factors: list[float],
+                split_factors: list[float]) -> list[tuple]:
+    rows = []
+    for fraction in fractions:
+        starts, ends = find_peak_bounds(int_stand > int_stand_mean * fraction)
+        durations = time[ends] - time[starts]
+        marker_rows = None
+        if marker is not None:
+            is_start_of_row = sum_over_peaks(marker, starts, ends) / (ends - starts + 1) > marker_mean
+            marker_rows = int(np.count_nonzero(np.diff(is_start_of_row.astype(np.int8), prepend=np.int8(0)) == 1))
+        # summed the way the engines sum total_duration
+        mean_duration = durations.sum() / durations.size if durations.size else np.nan
+        ordered = np.sort(durations[~np.isnan(durations)])
+        for merge_factor in merge_factors:
+            # peaks at or below the merge cutoff, the only ones that can be split
+            not_merged = np.searchsorted(ordered, merge_factor * mean_duration, side='right')
+            for split_factor in split_factors:
+                below_split = np.searchsorted(ordered, split_factor * mean_duration, side='left')
+                merged, split = int(ordered.size - not_merged), int(min(below_split, not_merged))
+                if np.isnan(mean_duration):
+                    # nothing compares above or below a NaN mean
+                    merged = split = 0
+                rows.append((fraction, merge_factor, split_factor, int(starts.size), merged, split, marker_rows))
+    return rows
+
+# Runs in a worker process: sweep_trace over the columns of a trace store or share_columns block
+def sweep_shared_trace(source: str | tuple[str, list[tuple]], fractions: list[float], int_stand_mean: float,
+                       marker_mean: float | None, merge_factors: list[float], split_factors: list[float]) -> list[tuple]:
+    columns, block = attach_columns(source)
+    try:
+        marker = columns['Marker'] if marker_mean is not None else None
+        rows = sweep_trace(columns['Time (min)'], columns['IS'], marker, fractions, int_stand_mean, marker_mean,
+                           merge_factors, split_factors)
+        # the views have to go before the block is closed
+        del columns, marker
+        return rows
+    finally:
+        if block is not None:
+            block.close()
+
+# One row per (threshold fraction, merge factor, split factor) of the run read into da, with
+# the peaks found, the potential merged and split peaks, and the peaks found minus the
+# num_rows * num_cols * num_droplets droplets the plate should give. The fractions are shared
+# out over the workers, default the analyzer's.
+def sweep_parameters(da: DataAnalyzer, marker_present: bool, num_rows: int, num_cols: int, num_droplets: int,
+                     fractions=DEFAULT_FRACTIONS, merge_factors=DEFAULT_MERGE_FACTORS,
+                     split_factors=DEFAULT_SPLIT_FACTORS, workers: int | None = None) -> pd.DataFrame:
+    fractions, merge_factors, split_factors = list(fractions), list(merge_factors), list(split_factors)
+    int_stand_mean = np.nanmean(da.int_stand)
+    marker_mean = np.nanmean(da.marker) if marker_present else None
+    num_workers = min(workers or da.workers, len(fractions))
+    if num_workers < 2:
+        rows = sweep_trace(da.time, da.int_stand, da.marker if marker_present else None, fractions,
+                           int_stand_mean, marker_mean, merge_factors, split_factors)
+    else:
+        if da.trace_store is not None:
+            # every worker maps the store itself, nothing is copied
+            block, source = None, da.trace_store
+        else:
+            block, layout = share_columns({'Time (min)': da.time, 'IS': da.int_stand, 'Marker': da.marker})
+            source = (block.name, layout)
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                # every worker gets fractions from across the grid
+                futures = [pool.submit(sweep_shared_trace, source, fractions[k::num_workers], int_stand_mean,
+                                       marker_mean, merge_factors, split_factors) for k in range(num_workers)]
+                rows = [row for future in futures for row in future.result()]
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+
+    expected = num_rows * num_cols * num_droplets
+    sweep = pd.DataFrame([row[:6] + (expected, row[3] - expected, row[6]) for row in rows], columns=SWEEP_COLUMNS)
+    if not marker_present:
+        sweep = sweep.drop(columns='marker_rows')
+    return sweep.sort_values(SWEEP_COLUMNS[:3], ignore_index=True)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Count the peaks and irregular peaks of a run over a grid of "
+                                                 "threshold fractions and merge/split factors.")
+    parser.add_argument("input", help="input file or trace store")
+    parser.add_argument("--rows", type=int, required=True, help="number of rows on the plate")
+    parser.add_argument("--cols", type=int, required=True, help="number of columns on the plate")
+    parser.add_argument("--droplets", type=int, required=True, help="droplets per sample")
+    parser.add_argument("--marker", action="store_true", help="the run has a marker channel")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_FRACTIONS,
+                        help=f"fractions of the mean IS to try as peak threshold (default in use: {THRESHOLD_FRACTION})")
+    parser.add_argument("--merge", type=float, nargs="+", default=DEFAULT_MERGE_FACTORS,
+                        help=f"merged-peak factors of the mean duration (default in use: {MERGE_FACTOR})")
+    parser.add_argument("--split", type=float, nargs="+", default=DEFAULT_SPLIT_FACTORS,
+                        help=f"split-peak factors of the mean duration (default in use: {SPLIT_FACTOR})")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--cache-dir", default=None, help="parsed-input cache directory")
+    parser.add_argument("--output", default=None, help="also write the table to this .csv file")
+    args = parser.parse_args(argv)
+
+    da = DataAnalyzer(cache=InputCache(args.cache_dir) if args.cache_dir else None)
+    try:
+        da.read_data(args.input)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{args.input}: {type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    sweep = sweep_parameters(da, args.marker, args.rows, args.cols, args.droplets, args.thresholds,
+                             args.merge, args.split, args.workers)
+    print(sweep.to_string(index=False))
+    if args.output:
+        sweep.to_csv(args.output, index=False)
+        print(f"written to {os.path.abspath(args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
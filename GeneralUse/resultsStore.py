@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+import time
+from datetime import datetime
+
+
+# Peak tables of many runs in one SQLite file, so a well or channel can be followed across
+# plates without opening every output workbook. Every run is one row of runs with its input,
+# output and plate layout, and its peaks are added in a single transaction. Channel values
+# are kept one row per (channel, well, run, peak), clustered in that order, so reading one
+# channel of a few wells over any number of runs only touches the rows it returns.
+# Several processes may add runs to the same file at once, SQLite serializes the writes.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    run_time REAL NOT NULL,
+    input TEXT,
+    input_size INTEGER,
+    input_mtime_ns INTEGER,
+    output TEXT,
+    engine TEXT,
+    marker_present INTEGER,
+    num_rows INTEGER,
+    num_cols INTEGER,
+    num_droplets INTEGER,
+    num_peaks INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (run_time);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS peaks (
+    run_id INTEGER NOT NULL,
+    peak_number INTEGER NOT NULL,
+    peak_center REAL,
+    duration REAL,
+    well TEXT NOT NULL,
+    potential_merged INTEGER NOT NULL,
+    potential_split INTEGER NOT NULL,
+    PRIMARY KEY (run_id, peak_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS peaks_well ON peaks (well, run_id);
+CREATE TABLE IF NOT EXISTS peak_values (
+    channel_id INTEGER NOT NULL,
+    well TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    peak_number INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (channel_id, well, run_id, peak_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS peak_values_run ON peak_values (run_id);
+"""
+
+RUN_COLUMNS = ("input", "input_size", "input_mtime_ns", "output", "engine", "marker_present",
+               "num_rows", "num_cols", "num_droplets")
+
+# seconds since the epoch of a time given as seconds, a datetime or a date string (UTC)
+def to_epoch(when: float | str | datetime) -> float:
+    if isinstance(when, (int, float)):
+        return float(when)
+    return pd.Timestamp(when).timestamp()
+
+class ResultsStore:
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # a batch may have several processes waiting on the same file
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _channel_ids(self, names: list[str]) -> list[int]:
+        self.connection.executemany("INSERT OR IGNORE INTO channels (name) VALUES (?)", [(name,) for name in names])
+        ids = dict(self.connection.execute("SELECT name, channel_id FROM channels"))
+        return [ids[name] for name in names]
+
+    # Adds one run and returns its run_id. info holds the RUN_COLUMNS, peaks the peak_number,
+    # peak_center, duration and well of every peak (well None when wells were not assigned)
+    # and the peak numbers flagged potential_merged and potential_split. values has one
+    # column per name in channels.
+    def add_run(self, info: dict, peaks: dict[str, np.ndarray], values: np.ndarray, channels: list[str]) -> int:
+        peak_numbers = np.asarray(peaks['peak_number'], dtype=np.int64)
+        wells = peaks['well']
+        wells = [""] * peak_numbers.size if wells is None else np.asarray(wells).tolist()
+        merged = np.isin(peak_numbers, peaks['potential_merged']).astype(int)
+        split = np.isin(peak_numbers, peaks['potential_split']).astype(int)
+        peak_numbers = peak_numbers.tolist()
+
+        with self.connection:
+            cursor = self.connection.execute(
+                f"INSERT INTO runs (run_time, num_peaks, {', '.join(RUN_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(RUN_COLUMNS) + 2))})",
+                [info.get('run_time', time.time()), len(peak_numbers)] + [info.get(name) for name in RUN_COLUMNS])
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO peaks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip([run_id] * len(peak_numbers), peak_numbers, np.asarray(peaks['peak_center']).tolist(),
+                    np.asarray(peaks['duration']).tolist(), wells, merged.tolist(), split.tolist()))
+            for channel_id, column in zip(self._channel_ids(channels), np.asarray(values).T):
+                self.connection.executemany(
+                    "INSERT INTO peak_values VALUES (?, ?, ?, ?, ?)",
+                    zip([channel_id] * len(peak_numbers), wells, [run_id] * len(peak_numbers), peak_numbers,
+                        column.tolist()))
+        return run_id
+
+    def delete_run(self, run_id: int) -> None:
+        with self.connection:
+            for table in ("peak_values", "peaks", "runs"):
+                self.connection.execute(f"DELETE FROM {table} WHERE run_id = ?", (run_id,))
+
+    def channels(self) -> list[str]:
+        return [name for name, in self.connection.execute("SELECT name FROM channels ORDER BY channel_id")]
+
+    # WHERE clauses and parameters on runs r for a time range and a list of runs
+    @staticmethod
+    def _run_filter(since, until, run_ids) -> tuple[list[str], list]:
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("r.run_time >= ?")
+            params.append(to_epoch(since))
+        if until is not None:
+            clauses.append("r.run_time < ?")
+            params.append(to_epoch(until))
+        if run_ids is not None:
+            run_ids = list(run_ids)
+            clauses.append(f"r.run_id IN ({', '.join('?' * len(run_ids))})")
+            params.extend(run_ids)
+        return clauses, params
+
+    def _query(self, sql: str, params: list) -> pd.DataFrame:
+        frame = pd.read_sql_query(sql, self.connection, params=params)
+        if 'run_time' in frame:
+            frame['run_time'] = pd.to_datetime(frame['run_time'], unit='s')
+        return frame
+
+    # one row per run, oldest first
+    def runs(self, since=None, until=None) -> pd.DataFrame:
+        clauses, params = self._run_filter(since, until, None)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"SELECT * FROM runs r {where} ORDER BY r.run_time, r.run_id", params)
+
+    # Every value of one channel in the given wells (all wells when None), one row per peak,
+    # for the runs between since and until or in run_ids
+    def well_values(self, channel: str, wells: list[str] | None = None, since=None, until=None,
+                    run_ids: list[int] | None = None) -> pd.DataFrame:
+        sql = ("SELECT v.run_id, r.run_time, v.well, v.peak_number, v.value FROM peak_values v "
+               "JOIN runs r ON r.run_id = v.run_id "
+               "WHERE v.channel_id = (SELECT channel_id FROM channels WHERE name = ?)")
+        params = [channel]
+        if wells is not None:
+            sql += f" AND v.well IN ({', '.join('?' * len(wells))})"
+            params += list(wells)
+        clauses, run_params = self._run_filter(since, until, run_ids)
+        for clause in clauses:
+            sql += f" AND {clause}"
+        params += run_params
+        return self._query(sql + " ORDER BY r.run_time, v.run_id, v.peak_number", params)
+
+    # well_values reduced to one row per run and well: droplets, mean, min and max
+    def well_means(self, channel: str, wells: list[str] | None = None, since=None, until=None,
+                   run_ids: list[int] | None = None) -> pd.DataFrame:
+        values = self.well_values(channel, wells, since, until, run_ids)
+        return (values.groupby(['run_id', 'run_time', 'well'], sort=False)['value']
+                .agg(droplets='count', mean='mean', min='min', max='max').reset_index())
+
+    # the peaks of one run with a column per channel, in peak order
+    def run_peaks(self, run_id: int) -> pd.DataFrame:
+        peaks = pd.read_sql_query("SELECT * FROM peaks WHERE run_id = ? ORDER BY peak_number",
+                                  self.connection, params=[run_id])
+        values = pd.read_sql_query(
+            "SELECT c.name AS channel, v.peak_number, v.value FROM peak_values v "
+            "JOIN channels c ON c.channel_id = v.channel_id WHERE v.run_id = ?", self.connection, params=[run_id])
+        wide = values.pivot(index='peak_number', columns='channel', values='value')
+        # channels in the order they were first stored
+        wide = wide[[name for name in self.channels() if name in wide.columns]]
+        return peaks.join(wide, on='peak_number')
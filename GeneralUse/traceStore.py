@@ -0,0 +1,79 @@
+import numpy as np
+import json
+import os
+import shutil
+from typing import Iterable
+
+
+# A parsed run kept on disk as one raw binary file per column, with a small JSON header
+# naming the columns, their dtypes and the number of samples. Columns are opened as
+# read-only memory maps, so nothing is parsed again, the OS page cache is shared by every
+# process that opens the same store, and runs larger than RAM can still be read.
+HEADER_NAME = "header.json"
+STORE_VERSION = 1
+
+def is_trace_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, HEADER_NAME))
+
+def read_header(store_dir: str) -> dict:
+    with open(os.path.join(store_dir, HEADER_NAME)) as f:
+        header = json.load(f)
+    if header.get('version') != STORE_VERSION:
+        raise ValueError(f"{store_dir} is a version {header.get('version')} trace store, "
+                         f"expected version {STORE_VERSION}")
+    return header
+
+# Write the columns, one chunk at a time, so the whole run never has to be in memory.
+# Every chunk must have the same columns. The store is written next to store_dir and
+# moved into place once complete, replacing an older store of the same name.
+def write_trace_store(chunks: Iterable[dict[str, np.ndarray]], store_dir: str, source: dict | None = None) -> str:
+    tmp_dir = store_dir + f".{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    files = {}
+    columns = []
+    num_samples = 0
+    try:
+        try:
+            for chunk in chunks:
+                if not files:
+                    for i, (name, values) in enumerate(chunk.items()):
+                        columns.append({'name': name, 'file': f"{i}.bin", 'dtype': values.dtype.str})
+                        files[name] = open(os.path.join(tmp_dir, f"{i}.bin"), 'wb')
+                for name, values in chunk.items():
+                    np.ascontiguousarray(values).tofile(files[name])
+                num_samples += len(next(iter(chunk.values()), ()))
+        finally:
+            for f in files.values():
+                f.close()
+    except BaseException:
+        # a conversion that fails part way leaves nothing behind
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    with open(os.path.join(tmp_dir, HEADER_NAME), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'num_samples': num_samples, 'columns': columns,
+                   'source': source}, f, indent=2)
+
+    if os.path.exists(store_dir):
+        old_dir = store_dir + f".{os.getpid()}.old"
+        os.replace(store_dir, old_dir)
+        os.replace(tmp_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, store_dir)
+    return store_dir
+
+# every column of a store as a read-only memory map, in the order they were written
+def open_trace_store(store_dir: str) -> dict[str, np.ndarray]:
+    header = read_header(store_dir)
+    num_samples = header['num_samples']
+    columns = {}
+    for column in header['columns']:
+        dtype = np.dtype(column['dtype'])
+        if num_samples == 0:
+            # an empty file cannot be mapped
+            columns[column['name']] = np.zeros(0, dtype=dtype)
+        else:
+            columns[column['name']] = np.memmap(os.path.join(store_dir, column['file']), dtype=dtype,
+                                                mode='r', shape=(num_samples,))
+    return columns
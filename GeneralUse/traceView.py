@@ -0,0 +1,143 @@
+import numpy as np
+import pyqtgraph as pg
+
+# samples per block grow by this factor from one decimation level to the next
+LEVEL_FACTOR = 8
+# coarsest level kept, in blocks
+MIN_LEVEL_BLOCKS = 2048
+# min/max pairs drawn per horizontal pixel of the plot
+PAIRS_PER_PIXEL = 2
+
+# Min and max of a trace over blocks of LEVEL_FACTOR ** k samples for every level k, so the
+# envelope of any time range can be drawn from about as many points as the plot has pixels.
+# NaN samples are left out of a block; a block of only NaN is a gap in the curve.
+class MinMaxPyramid:
+
+    def __init__(self, time: np.ndarray, values: np.ndarray):
+        self.time = np.asarray(time)
+        self.values = np.asarray(values)
+        self.levels: list[tuple[int, np.ndarray, np.ndarray]] = []
+        block = 1
+        mins = maxs = self.values
+        while mins.size > MIN_LEVEL_BLOCKS:
+            pad = -mins.size % LEVEL_FACTOR
+            if pad:
+                mins = np.concatenate((mins, np.full(pad, np.nan, dtype=mins.dtype)))
+                maxs = np.concatenate((maxs, np.full(pad, np.nan, dtype=maxs.dtype)))
+            with np.errstate(invalid='ignore'):
+                mins = np.fmin.reduce(mins.reshape(-1, LEVEL_FACTOR), axis=1)
+                maxs = np.fmax.reduce(maxs.reshape(-1, LEVEL_FACTOR), axis=1)
+            block *= LEVEL_FACTOR
+            self.levels.append((block, mins, maxs))
+
+    # (x, y) to draw between x_min and x_max with at most about max_points points
+    def curve(self, x_min: float, x_max: float, max_points: int) -> tuple[np.ndarray, np.ndarray]:
+        start = max(int(np.searchsorted(self.time, x_min)) - 1, 0)
+        stop = min(int(np.searchsorted(self.time, x_max)) + 1, self.time.size)
+        if stop - start <= max_points:
+            return self.time[start:stop], self.values[start:stop]
+        # the finest level that fits, or the coarsest there is
+        block, mins, maxs = self.levels[-1]
+        for level in self.levels:
+            if (stop - start) // level[0] * 2 <= max_points:
+                block, mins, maxs = level
+                break
+        first, last = start // block, min(-(-stop // block), mins.size)
+        x = np.repeat(self.time[np.arange(first, last) * block], 2)
+        y = np.empty(x.size, dtype=mins.dtype)
+        y[0::2] = mins[first:last]
+        y[1::2] = maxs[first:last]
+        return x, y
+
+# x of the spans in view, as start, end pairs for connect='pairs'. Spans closer together than
+# min_gap are drawn as one, so a zoomed out view never holds more segments than pixels.
+def visible_spans(starts: np.ndarray, ends: np.ndarray, x_min: float, x_max: float, min_gap: float) -> np.ndarray:
+    first = np.searchsorted(ends, x_min)
+    last = np.searchsorted(starts, x_max, side='right')
+    starts, ends = starts[first:last], ends[first:last]
+    if starts.size > 1:
+        breaks = np.flatnonzero(starts[1:] - ends[:-1] > min_gap)
+        starts = np.concatenate((starts[:1], starts[1:][breaks]))
+        ends = np.concatenate((ends[:-1][breaks], ends[-1:]))
+    x = np.empty(starts.size * 2)
+    x[0::2] = starts
+    x[1::2] = ends
+    return x
+
+# what TraceView.set_trace takes for one finished run: a pyramid per channel and the start and
+# end time of every peak, plus those of the flagged peaks (1 based peak numbers)
+def build_trace(time: np.ndarray, channels: dict[str, np.ndarray], peak_centers: np.ndarray,
+                durations: np.ndarray, flagged: dict[str, np.ndarray]
+                ) -> tuple[dict[str, MinMaxPyramid], dict[str, tuple[np.ndarray, np.ndarray]]]:
+    pyramids = {name: MinMaxPyramid(time, values) for name, values in channels.items()}
+    starts = peak_centers - durations / 2
+    ends = peak_centers + durations / 2
+    spans = {'peaks': (starts, ends)}
+    for name, peak_numbers in flagged.items():
+        spans[name] = (starts[peak_numbers - 1], ends[peak_numbers - 1])
+    return pyramids, spans
+
+# Raw trace panel: every channel as a min/max envelope that is recomputed for the visible
+# time range whenever the view moves, the IS threshold as a line, and the detected peaks and
+# flagged droplets as one segment item each, drawn along the threshold.
+class TraceView(pg.PlotWidget):
+
+    CHANNEL_PENS = {'IS': '#4FC3F7', 'Marker': '#AED581'}
+    OTHER_PEN = '#FFB74D'
+    SPAN_PENS = {'peaks': pg.mkPen('#FFFFFF', width=3), 'potential_merged': pg.mkPen('#E53935', width=5),
+                 'potential_split': pg.mkPen('#FDD835', width=5)}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setLabel('bottom', 'Time (min)')
+        self.showGrid(x=True, y=True, alpha=0.2)
+        self.addLegend()
+        self.pyramids: dict[str, MinMaxPyramid] = {}
+        self.curves: dict[str, pg.PlotDataItem] = {}
+        self.spans: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.span_items: dict[str, pg.PlotDataItem] = {}
+        self.threshold = 0.0
+        self.threshold_line = pg.InfiniteLine(angle=0, pen=pg.mkPen('#888888', style=pg.QtCore.Qt.PenStyle.DashLine))
+        self.addItem(self.threshold_line)
+        self.getPlotItem().sigXRangeChanged.connect(self.refresh)
+
+    # pyramids take a while on long runs, so they are built off the GUI thread and handed in
+    def set_trace(self, pyramids: dict[str, MinMaxPyramid], threshold: float,
+                  spans: dict[str, tuple[np.ndarray, np.ndarray]], keep_view: bool = False) -> None:
+        view_range = self.getPlotItem().viewRange()
+        for item in [*self.curves.values(), *self.span_items.values()]:
+            self.removeItem(item)
+        self.pyramids = pyramids
+        self.threshold = threshold
+        self.spans = spans
+        self.curves = {name: self.plot(pen=self.CHANNEL_PENS.get(name, self.OTHER_PEN), name=name,
+                                       connect='finite') for name in pyramids}
+        self.threshold_line.setValue(threshold)
+        self.span_items = {name: self.plot(pen=self.SPAN_PENS[name], connect='pairs',
+                                           name=None if name == 'peaks' else name) for name in spans}
+        times = [pyramid.time for pyramid in pyramids.values() if pyramid.time.size]
+        if keep_view:
+            self.setRange(xRange=view_range[0], yRange=view_range[1], padding=0)
+        elif times:
+            self.setXRange(times[0][0], times[0][-1], padding=0)
+            self.enableAutoRange(axis='y')
+        self.refresh()
+
+    def refresh(self) -> None:
+        if not self.pyramids:
+            return
+        x_min, x_max = self.getPlotItem().viewRange()[0]
+        width = max(self.getPlotItem().vb.width(), 1)
+        for name, pyramid in self.pyramids.items():
+            x, y = pyramid.curve(x_min, x_max, int(width * PAIRS_PER_PIXEL * 2))
+            self.curves[name].setData(x, y, connect='finite')
+        pixel = (x_max - x_min) / width
+        for name, (starts, ends) in self.spans.items():
+            x = visible_spans(starts, ends, x_min, x_max, pixel)
+            self.span_items[name].setData(x, np.full(x.size, self.threshold), connect='pairs')
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        # PlotWidget.__init__ resizes before the trace attributes exist
+        if hasattr(self, 'curves'):
+            self.refresh()
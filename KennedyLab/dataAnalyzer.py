@@ -1,179 +1,1043 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields
+from typing import Callable, Iterator
+import itertools
+import operator
+import openpyxl
 import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from inputCache import InputCache
+import numbaKernels
+from outputWriters import write_tables
+from resultsStore import ResultsStore
+from stageReport import StageReport
+from traceStore import HEADER_NAME, is_trace_store, open_trace_store, read_header, write_trace_store
 
 
+# one array per field, one entry per peak
 @dataclass
-class Peak:
-    peak_number: int
-    peak_center: float
-    duration: float
-    intensityA: float
-    intensityB: float
-    internal_standard: float
-    is_start_of_row: bool
+class PeakTable:
+    peak_number: np.ndarray
+    peak_center: np.ndarray
+    duration: np.ndarray
+    intensityA: np.ndarray
+    intensityB: np.ndarray
+    internal_standard: np.ndarray
+    marker: np.ndarray
+    is_start_of_row: np.ndarray
+
+    def __len__(self) -> int:
+        return self.peak_number.size
+
+    # slice or mask every field at once
+    def __getitem__(self, index) -> "PeakTable":
+        return PeakTable(*(getattr(self, f.name)[index] for f in fields(self)))
+
+    @classmethod
+    def empty(cls) -> "PeakTable":
+        return cls(np.zeros(0, dtype=np.int64), *(np.zeros(0) for _ in range(6)), np.zeros(0, dtype=bool))
+
+    @classmethod
+    def concat(cls, tables: list["PeakTable"]) -> "PeakTable":
+        if not tables:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(t, f.name) for t in tables]) for f in fields(cls)))
+
+# "python" is the original sample-by-sample loop, kept so results can be compared
+ENGINES = ("python", "numpy", "parallel", "numba")
+# the parallel engine gives each worker at least this many samples, shorter runs use numpy
+PARALLEL_CHUNK_SAMPLES = 1_000_000
+# how IS, Marker and isomer intensities are stored; Time always stays float64
+INTENSITY_DTYPES = ("float64", "float32")
+# a sample is part of a peak when its IS is above this fraction of the run's mean IS
+THRESHOLD_FRACTION = 0.25
+# a peak lasting more than MERGE_FACTOR times the mean peak duration may be two merged
+# droplets, one lasting less than SPLIT_FACTOR times it may be half of a split droplet
+MERGE_FACTOR = 1.5
+SPLIT_FACTOR = 0.55
+
+# start and end index of every run above threshold, using the same bounds as the legacy loop
+def find_peak_bounds(above: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    above = above.astype(np.int8)
+    if above.size:
+        # the legacy loop never looks at the first sample
+        above[0] = 0
+    edges = np.diff(above)
+    starts = np.flatnonzero(edges == 1) + 1
+    ends = np.flatnonzero(edges == -1)
+    # a peak still open at the last sample is never closed, so it is dropped
+    return starts[:ends.size], ends
+
+# sum values[start:end + 1] for every peak in one pass
+def sum_over_peaks(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    if starts.size == 0:
+        return np.zeros(0)
+    bounds = np.empty(starts.size * 2, dtype=np.intp)
+    bounds[0::2] = starts
+    bounds[1::2] = ends + 1
+    return np.add.reduceat(values, bounds, dtype=np.float64)[0::2]
+
+# Sample indices to cut a trace into about num_chunks pieces for the parallel engine.
+# Every cut is a sample below threshold at or after an even split, so no peak crosses a
+# cut and each piece can be searched on its own. Returns the first sample of every piece.
+def find_gap_cuts(int_stand: np.ndarray, threshold: float, num_chunks: int, window: int = 4096) -> list[int]:
+    cuts = [0]
+    for k in range(1, num_chunks):
+        i = max(k * int_stand.size // num_chunks, cuts[-1] + 1)
+        step = window
+        while i < int_stand.size:
+            below = np.flatnonzero(~(int_stand[i:i + step] > threshold))
+            if below.size:
+                cuts.append(i + int(below[0]))
+                break
+            i += step
+            step *= 2
+        else:
+            # no gap left before the end of the trace
+            break
+    return cuts
+
+# copy columns into one shared memory block, returns it with the (name, dtype, offset, size)
+# of every column so worker processes can open them without copying
+def share_columns(columns: dict[str, np.ndarray]) -> tuple[shared_memory.SharedMemory, list[tuple]]:
+    layout = []
+    offset = 0
+    for name, values in columns.items():
+        offset = -(-offset // 64) * 64
+        layout.append((name, values.dtype.str, offset, values.size))
+        offset += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, offset, size), values in zip(layout, columns.values()):
+        np.ndarray(size, dtype=dtype, buffer=block.buf, offset=offset)[:] = values
+    return block, layout
+
+# potentially merged and potentially split peaks as one bool per peak
+def flag_irregulars(durations: np.ndarray, mean_duration: float, merge_factor: float = MERGE_FACTOR,
+                    split_factor: float = SPLIT_FACTOR) -> tuple[np.ndarray, np.ndarray]:
+    merged = durations > merge_factor * mean_duration
+    split = ~merged & (durations < split_factor * mean_duration)
+    return merged, split
+
+# Opens the columns of a trace store directory or of the (block name, layout) of
+# share_columns in a worker process. Returns them with the shared memory block, None for a
+# trace store, which has to be closed once every view of it is gone.
+def attach_columns(source: str | tuple[str, list[tuple]]) -> tuple[dict[str, np.ndarray], shared_memory.SharedMemory | None]:
+    if isinstance(source, str):
+        return dict(open_trace_store(source)), None
+    block_name, layout = source
+    block = shared_memory.SharedMemory(name=block_name)
+    return {name: np.ndarray(size, dtype=dtype, buffer=block.buf, offset=offset)
+            for name, dtype, offset, size in layout}, block
+
+# Runs in a worker process: the peaks of samples start to stop - 1, as durations, centers
+# and the mean of every column in value_columns (one row per column). source is a trace
+# store directory or the (block name, layout) of share_columns. Pieces start and end on a
+# sample below threshold, so the legacy bounds hold in each.
+def find_peaks_in_slice(source: str | tuple[str, list[tuple]], start: int, stop: int, threshold: float,
+                        value_columns: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    columns, block = attach_columns(source)
+    try:
+        columns = {name: values[start:stop] for name, values in columns.items()}
+        starts, ends = find_peak_bounds(columns['IS'] > threshold)
+        counts = ends - starts + 1
+        time = columns['Time (min)']
+        durations = time[ends] - time[starts]
+        peak_centers = (time[ends] + time[starts]) / 2
+        means = np.empty((len(value_columns), starts.size))
+        for j, name in enumerate(value_columns):
+            means[j] = sum_over_peaks(columns[name], starts, ends) / counts
+        # the views have to go before the block is closed
+        del columns, time
+        return durations, peak_centers, means
+    finally:
+        if block is not None:
+            block.close()
+
+# columns the analyzer needs from an input file
+INPUT_COLUMNS = ['Time (min)', 'Isomer 77', 'Isomer 57', 'IS', 'Marker']
+
+def is_input_column(col) -> bool:
+    return str(col).strip() in INPUT_COLUMNS
+
+# columns write_data can write, in file order
+DERIVED_COLUMNS = ['ratio', 'yield', 'isoA / internal_standard ratio', 'isoB / internal_standard ratio']
+OUTPUT_COLUMNS = ['peak_number', 'peak_center', 'duration', 'intensityA', 'intensityB', 'internal_standard',
+                  *DERIVED_COLUMNS, 'potential_merged', 'potential_split', 'well']
+# output columns with a value per droplet that the heatmap and the per-well summary show
+HEATMAP_CHANNELS = ['intensityA', 'intensityB', 'internal_standard', *DERIVED_COLUMNS]
+
+# read the needed columns of a .csv or .xlsx file, at most chunk_size rows at a time
+def iter_input_chunks(filepath: str, chunk_size: int) -> Iterator[dict[str, np.ndarray]]:
+    if is_trace_store(filepath):
+        columns = {col: values for col, values in open_trace_store(filepath).items() if is_input_column(col)}
+        num_samples = read_header(filepath)['num_samples']
+        for start in range(0, num_samples, chunk_size):
+            yield {col: np.asarray(values[start:start + chunk_size], dtype=np.float64)
+                   for col, values in columns.items()}
+        return
+
+    if filepath.lower().endswith(".csv"):
+        for chunk in pd.read_csv(filepath, chunksize=chunk_size, usecols=is_input_column):
+            chunk.columns = chunk.columns.str.strip()
+            yield {col: chunk[col].to_numpy(dtype=np.float64) for col in chunk.columns}
+        return
+
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [str(col).strip() for col in next(rows, ())]
+        keep = [i for i, col in enumerate(header) if is_input_column(col)]
+        pick = operator.itemgetter(*keep)
+        while True:
+            block = [pick(row) for row in itertools.islice(rows, chunk_size)]
+            if not block:
+                break
+            values = np.array(block, dtype=np.float64).reshape(len(block), len(keep))
+            yield {header[i]: values[:, j] for j, i in enumerate(keep)}
+    finally:
+        workbook.close()
+
+# finds peaks in a trace that arrives one chunk at a time. A peak still open at the
+# end of a chunk is carried over as running sums and finished by a later chunk.
+class PeakDetector:
+
+    def __init__(self, int_stand_mean: float, marker_mean: float | None, marker_present: bool):
+        self.threshold = int_stand_mean * THRESHOLD_FRACTION
+        self.marker_mean = marker_mean
+        self.marker_present = marker_present
+        self.num_peaks = 0
+        self.total_duration = 0
+        self.num_durations = 0
+
+        self.prev_above: bool | None = None
+        self.open_start_time = 0.0
+        self.open_end_time = 0.0
+        self.open_count = 0
+        self.open_sums = np.zeros(4)  # IS, Marker, Isomer 57, Isomer 77
+
+    # feed the next chunk of samples, returns the peaks that finished inside it
+    def feed(self, chunk: dict[str, np.ndarray]) -> PeakTable:
+        time = chunk['Time (min)']
+        columns = [chunk['IS'], chunk['Marker'], chunk['Isomer 57'], chunk['Isomer 77']]
+        if time.size == 0:
+            return PeakTable.empty()
+
+        above = (chunk['IS'] > self.threshold).astype(np.int8)
+        if self.prev_above is None:
+            # the legacy loop never looks at the first sample
+            above[0] = 0
+            self.prev_above = False
+        was_open = self.prev_above
+        edges = np.diff(above, prepend=np.int8(was_open))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges[1:] == -1)
+        continues_open = was_open and bool(above[0])
+        if continues_open:
+            starts = np.concatenate(([0], starts))
+        self.prev_above = bool(above[-1])
+
+        closed = starts[:ends.size]
+        counts = ends - closed + 1
+        start_times = time[closed]
+        end_times = time[ends]
+        sums = np.array([sum_over_peaks(values, closed, ends) for values in columns]).reshape(len(columns), ends.size)
+        if continues_open and ends.size:
+            counts[0] += self.open_count
+            sums[:, 0] += self.open_sums
+            start_times[0] = self.open_start_time
+        elif was_open and not continues_open:
+            # the open peak ended on the last sample of the previous chunk
+            counts = np.concatenate(([self.open_count], counts))
+            sums = np.column_stack((self.open_sums, sums))
+            start_times = np.concatenate(([self.open_start_time], start_times))
+            end_times = np.concatenate(([self.open_end_time], end_times))
+
+        # peak still open at the end of this chunk
+        if starts.size > ends.size:
+            tail = starts[-1]
+            tail_sums = np.array([values[tail:].sum(dtype=np.float64) for values in columns])
+            if continues_open and not ends.size:
+                self.open_sums = self.open_sums + tail_sums
+                self.open_count += time.size
+            else:
+                self.open_sums = tail_sums
+                self.open_count = time.size - tail
+                self.open_start_time = time[tail]
+            self.open_end_time = time[-1]
+
+        num_closed = counts.size
+        durations = end_times - start_times
+        peak_centers = (end_times + start_times) / 2
+        means = sums / counts
+        if self.marker_present:
+            is_new_row = means[1] > self.marker_mean
+        else:
+            is_new_row = np.zeros(num_closed, dtype=bool)
+
+        self.num_durations += num_closed
+        self.total_duration += durations.sum()
+        peak_numbers = np.arange(self.num_peaks + 1, self.num_peaks + num_closed + 1)
+        self.num_peaks += num_closed
+        return PeakTable(peak_numbers, peak_centers, durations, means[2], means[3], means[0], means[1], is_new_row)
+
+# plate row label: A to Z, then AA, AB, ... as on 1536-well plates
+def row_label(index: int) -> str:
+    label = ""
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        label = chr(ord('A') + letter) + label
+    return label
+
+# plate row index of a row label, the inverse of row_label
+def row_index(label: str) -> int:
+    index = 0
+    for letter in label:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+# Where the last peak of a walk ended: peaks walked, its plate row and well number, and
+# whether it started a row. Passed back to walk_positions to continue the walk.
+WalkState = tuple[int, int, int, bool]
+
+# (row, well number) of every peak, walked the way create_well_list always has: from the
+# last row and last column down, moving up a row at each rising edge of is_start_of_row and
+# one column every num_droplets peaks. A run that arrives in batches continues from the
+# state of the previous batch; returns the state after the last peak too.
+def walk_positions(is_start_of_row: np.ndarray, num_rows: int, num_cols: int, num_droplets: int,
+                   after: WalkState | None = None) -> tuple[np.ndarray, np.ndarray, WalkState]:
+    first_peak, last_row, last_well, last_start = after or (0, num_rows - 1, num_cols, False)
+    num_peaks = is_start_of_row.size
+    i = first_peak + np.arange(num_peaks)
+    starts = is_start_of_row.astype(bool)
+    previous = np.concatenate(([last_start], starts[:-1]))
+    new_row = starts & ~previous & (i != 0)
+    row = (last_row - np.cumsum(new_row)) % num_rows
+
+    # a row starts back at num_cols, then moves one well every num_droplets peaks
+    next_well = (i % num_droplets == 0) & (i != 0) & ~new_row
+    wells_moved = np.cumsum(next_well)
+    moved_before_row = np.maximum.accumulate(np.where(new_row, wells_moved, 0))
+    in_new_row = np.logical_or.accumulate(new_row)
+    well_number = np.where(in_new_row, num_cols - (wells_moved - moved_before_row), last_well - wells_moved)
+    if num_peaks:
+        last_row, last_well, last_start = int(row[-1]), int(well_number[-1]), bool(starts[-1])
+    return row, well_number, (first_peak + num_peaks, last_row, last_well, last_start)
+
+# Plate of shape (rows, cols, channels) from values with one row per peak, oldest first, and
+# one column per channel. The last rows * cols * num_droplets peaks are read newest first, one
+# plate row of wells at a time, and the second droplet of each well is kept. Wells with no peak
+# are NaN.
+def heatmap_cube(values: np.ndarray, rows: int, cols: int, num_droplets: int) -> np.ndarray:
+    plate_peaks = rows * cols * num_droplets
+    newest_first = values[::-1][:plate_peaks]
+    if len(newest_first) < plate_peaks:
+        missing = np.full((plate_peaks - len(newest_first), values.shape[1]), np.nan)
+        newest_first = np.concatenate((newest_first, missing))
+    return newest_first.reshape(rows, cols, num_droplets, values.shape[1])[:, :, min(1, num_droplets - 1)]
+
+# Well of every peak, plus the peaks of every well, as walked by walk_positions.
+# Labels are only built by labels(), when the output is written.
+@dataclass
+class WellIndex:
+    row: np.ndarray  # plate row of each peak, 0 is row A
+    well_number: np.ndarray  # column number of each peak, below 1 once a row has more wells than columns
+    well_id: np.ndarray  # index of the peak's well among the wells that have peaks, in plate order
+    order: np.ndarray  # peak indices sorted by well_id
+    offsets: np.ndarray  # the peaks of well_id k are order[offsets[k]:offsets[k + 1]]
+    well_rows: np.ndarray  # plate row of each well_id
+    well_numbers: np.ndarray  # column number of each well_id
+    num_rows: int
+
+    @classmethod
+    def assign(cls, is_start_of_row: np.ndarray, num_rows: int, num_cols: int, num_droplets: int) -> "WellIndex":
+        row, well_number, _ = walk_positions(is_start_of_row, num_rows, num_cols, num_droplets)
+        return cls.from_positions(row, well_number, num_rows)
+
+    # Index of peaks whose (row, well number) are already known. Only the wells that have
+    # peaks get an id, so without a marker, where the well numbers run far past the plate,
+    # nothing is sized by the range of well numbers.
+    @classmethod
+    def from_positions(cls, row: np.ndarray, well_number: np.ndarray, num_rows: int) -> "WellIndex":
+        row, well_number = row.astype(np.int64), well_number.astype(np.int64)
+        min_well_number = int(well_number.min()) if row.size else 1
+        span = int(well_number.max()) - min_well_number + 1 if row.size else 0
+        wells, well_id = np.unique(row * span + (well_number - min_well_number), return_inverse=True)
+        order = np.argsort(well_id, kind='stable')
+        offsets = np.zeros(wells.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(well_id, minlength=wells.size), out=offsets[1:])
+        return cls(row, well_number, well_id, order, offsets, wells // max(span, 1),
+                   wells % max(span, 1) + min_well_number, num_rows)
+
+    def __len__(self) -> int:
+        return self.row.size
+
+    @property
+    def num_wells(self) -> int:
+        return self.well_rows.size
+
+    # "C7"-style label of every peak, each well is labelled once
+    def labels(self) -> np.ndarray:
+        return self.well_labels(np.arange(self.num_wells))[self.well_id]
+
+    # "C7"-style label of each well id
+    def well_labels(self, well_ids: np.ndarray) -> np.ndarray:
+        row_labels = np.array([row_label(r) for r in range(self.num_rows)])
+        return np.char.add(row_labels[self.well_rows[well_ids]], self.well_numbers[well_ids].astype(str))
+
+    # Mean, median, coefficient of variation, min and max of every column of values over
+    # the peaks of each occupied well, each of shape (wells, columns). The peaks are put in
+    # well order once and every statistic is a reduceat over the well boundaries. NaN and
+    # inf values are left out.
+    def well_stats(self, values: np.ndarray) -> dict[str, np.ndarray]:
+        counts = np.diff(self.offsets)
+        bounds = self.offsets[:-1]
+        if not bounds.size:
+            empty = np.zeros((0, values.shape[1]))
+            return {"mean": empty, "median": empty, "cv": empty, "min": empty, "max": empty}
+        grouped = values[self.order]
+        valid = np.isfinite(grouped)
+        num_valid = np.add.reduceat(valid, bounds, axis=0)
+        well_of_peak = np.repeat(np.arange(bounds.size), counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.add.reduceat(np.where(valid, grouped, 0.0), bounds, axis=0) / num_valid
+            deviations = np.where(valid, grouped - mean[well_of_peak], 0.0)
+            cv = np.sqrt(np.add.reduceat(deviations ** 2, bounds, axis=0) / (num_valid - 1)) / mean
+        low = np.minimum.reduceat(np.where(valid, grouped, np.inf), bounds, axis=0)
+        high = np.maximum.reduceat(np.where(valid, grouped, -np.inf), bounds, axis=0)
+
+        # sort each well's values with the invalid ones last, then average the middle two
+        median = np.empty_like(mean)
+        for j in range(values.shape[1]):
+            column = np.where(valid[:, j], grouped[:, j], np.inf)
+            in_well_order = column[np.lexsort((column, well_of_peak))]
+            lower = bounds + np.maximum(num_valid[:, j] - 1, 0) // 2
+            upper = bounds + num_valid[:, j] // 2
+            median[:, j] = (in_well_order[lower] + in_well_order[upper]) / 2
+
+        no_values = num_valid == 0
+        for stat in (mean, median, low, high):
+            stat[no_values] = np.nan
+        return {"mean": mean, "median": median, "cv": cv, "min": low, "max": high}
+
+    # indices of the peaks in a well, e.g. peaks_in("C7"), without searching the peaks
+    def peaks_in(self, well: str) -> np.ndarray:
+        letters = well.rstrip("-0123456789")
+        row, number = row_index(letters), int(well[len(letters):])
+        # well ids are in plate order, so the wells of a row are one sorted run
+        first, last = np.searchsorted(self.well_rows, [row, row + 1])
+        well_id = first + np.searchsorted(self.well_numbers[first:last], number)
+        if well_id == last or self.well_numbers[well_id] != number:
+            return np.zeros(0, dtype=np.int64)
+        return self.order[self.offsets[well_id]:self.offsets[well_id + 1]]
+
+# peak numbers padded with blanks to the length of the output table
+def pad_peak_numbers(peak_numbers: np.ndarray, length: int) -> pd.arrays.IntegerArray:
+    padded = pd.array(np.zeros(length, dtype=np.int64), dtype="Int64")
+    padded[:peak_numbers.size] = peak_numbers
+    padded[peak_numbers.size:] = pd.NA
+    return padded
+
+# identifies a version of a file without reading it
+def file_signature(filepath: str) -> tuple[str, int, int]:
+    # a trace store is rewritten as a whole, its header stands for it
+    stat = os.stat(os.path.join(filepath, HEADER_NAME) if is_trace_store(filepath) else filepath)
+    return os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns
+
+# Parse an input file once into a trace store (see traceStore.py) that read_data, the
+# streaming reader and the parallel engine then map instead of parsing. A store already
+# made from the same version of the file is kept as it is.
+def convert_to_trace_store(filepath: str, store_dir: str, chunk_size: int = 100_000,
+                           intensity_dtype: str = "float64") -> str:
+    path, size, mtime_ns = file_signature(filepath)
+    source = {'path': path, 'size': size, 'mtime_ns': mtime_ns}
+    if is_trace_store(store_dir):
+        try:
+            if read_header(store_dir)['source'] == source:
+                return store_dir
+        except ValueError:
+            pass
+
+    def chunks() -> Iterator[dict[str, np.ndarray]]:
+        for chunk in iter_input_chunks(filepath, chunk_size):
+            yield {col: values if col == 'Time (min)' else values.astype(intensity_dtype) for col, values in chunk.items()}
+    return write_trace_store(chunks(), store_dir, source)
+
+# raised by run_all when cancel() was called, names the stage that did not run
+class AnalysisCancelled(Exception):
+    pass
+
+# What run_all found, for callers that use the results from code. Every array is the
+# analyzer's own, so nothing is copied or rounded and nothing has to be written to disk.
+# The heatmap is only there when the run had a marker.
+@dataclass
+class AnalysisResult:
+    peaks: PeakTable
+    potential_merged: np.ndarray  # peak numbers
+    potential_split: np.ndarray  # peak numbers
+    wells: WellIndex | None
+    heatmap_cube: np.ndarray | None  # shape (rows, cols, channels), see create_heatmap_cube
+    heatmap_names: list[str]
+    output_filepath: str | None  # None when run_all was not given an output
+
+    def __len__(self) -> int:
+        return len(self.peaks)
+
+    # flags as one bool per peak
+    @property
+    def is_merged(self) -> np.ndarray:
+        return np.isin(self.peaks.peak_number, self.potential_merged)
+
+    @property
+    def is_split(self) -> np.ndarray:
+        return np.isin(self.peaks.peak_number, self.potential_split)
+
+    # one array per column, one entry per peak; well only when wells were assigned
+    def to_numpy(self) -> dict[str, np.ndarray]:
+        peaks = self.peaks
+        columns = {'peak_number': peaks.peak_number, 'peak_center': peaks.peak_center, 'duration': peaks.duration}
+        columns.update(intensityA=peaks.intensityA, intensityB=peaks.intensityB,
+                       internal_standard=peaks.internal_standard, marker=peaks.marker)
+        if self.wells is not None:
+            columns['well'] = self.wells.labels()
+        columns['potential_merged'] = self.is_merged
+        columns['potential_split'] = self.is_split
+        return columns
+
+    # a DataFrame over the to_numpy arrays, one block per column so none is copied
+    def to_pandas(self) -> pd.DataFrame:
+        return pd.DataFrame(self.to_numpy(), copy=False)
+
+    # numeric columns are wrapped as they are, only the well labels are converted
+    def to_arrow(self):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Arrow export needs pyarrow (pip install pyarrow)") from None
+        columns = self.to_numpy()
+        return pa.table({name: pa.array(values) for name, values in columns.items()})
 
 class DataAnalyzer:
     
-    def __init__(self):
-        self.peaks: list[Peak] = []
-        self.potential_split: list[int] = []
-        self.potential_merged: list[int] = []
+    def __init__(self, engine: str = "numpy", cache: InputCache | None = None, intensity_dtype: str = "float64",
+                 workers: int | None = None):
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+        if intensity_dtype not in INTENSITY_DTYPES:
+            raise ValueError(f"intensity_dtype must be one of {INTENSITY_DTYPES}, got {intensity_dtype!r}")
+        if engine == "numba" and not numbaKernels.AVAILABLE:
+            warnings.warn("numba is not installed, using the numpy engine instead")
+            engine = "numpy"
+        self.engine = engine
+        self.intensity_dtype = np.dtype(intensity_dtype)
+        # worker processes of the parallel engine, default one per core
+        self.workers = workers or os.cpu_count() or 1
+        # trace store the columns are mapped from, when they were read from one unchanged
+        self.trace_store: str | None = None
+        self.cache = cache
+        self.cancel_requested = False
+        self.peaks: PeakTable | None = None
+        self.potential_split: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.potential_merged: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.wells: WellIndex | None = None
+        self.num_samples = 0
+        self.output_filepath: str | None = None
+        # run_id of the last run added to a results store
+        self.results_run_id: int | None = None
+        self.heatmap_cube: np.ndarray | None = None
+        self.heatmap_names: list[str] = []
+        # stage name -> the inputs it last ran with, see stale_stages
+        self.stage_keys: dict[str, tuple] = {}
+        self.stage_runs = 0
         
         self.total_duration = 0
         self.num_durations = 0
     
-    # read in data from input file
+    # read in data from input file, through the parsed-input cache when there is one
     def read_data(self, filepath: str) -> None:
-        self.df: pd.DataFrame = pd.read_excel(filepath, usecols=['Time (min)', 'Isomer 77', 'Isomer 57', 'IS', 'Marker'])
-        self.time = self.df['Time (min)'].to_numpy()
-        self.isoA = self.df['Isomer 57'].to_numpy()
-        self.isoB = self.df['Isomer 77'].to_numpy()
-        self.int_stand = self.df['IS'].to_numpy()
-        self.marker = self.df['Marker'].to_numpy()
+        if is_trace_store(filepath):
+            columns = open_trace_store(filepath)
+            self._set_columns(columns)
+            # only when no column had to be converted to intensity_dtype
+            if all(values.dtype == self.intensity_dtype for col, values in columns.items()
+                   if is_input_column(col) and col != 'Time (min)'):
+                self.trace_store = filepath
+            return
+        if self.cache is None:
+            self._set_columns(self._parse_input(filepath))
+            return
+        key = self.cache.key_for(filepath)
+        columns = self.cache.load(key, filepath)
+        # an entry stored as float32 is parsed again for a float64 analyzer
+        if columns is None or columns['IS'].dtype.itemsize < self.intensity_dtype.itemsize:
+            columns = self._parse_input(filepath)
+            self.cache.store(key, filepath, columns)
+        self._set_columns(columns)
+
+    # parse only the needed columns of the input, one block of rows at a time, so the
+    # other columns are never converted and no DataFrame is kept around
+    def _parse_input(self, filepath: str, chunk_size: int = 100_000) -> dict[str, np.ndarray]:
+        parts: dict[str, list[np.ndarray]] = {}
+        for chunk in iter_input_chunks(filepath, chunk_size):
+            for col, values in chunk.items():
+                parts.setdefault(col, []).append(values if col == 'Time (min)' else values.astype(self.intensity_dtype))
+        return {col: np.concatenate(values) for col, values in parts.items()}
+
+    def _set_columns(self, columns: dict[str, np.ndarray]) -> None:
+        self.trace_store = None
+        self.time = columns['Time (min)']
+        self.num_samples = self.time.size
+        self.isoA = columns['Isomer 57'].astype(self.intensity_dtype, copy=False)
+        self.isoB = columns['Isomer 77'].astype(self.intensity_dtype, copy=False)
+        self.int_stand = columns['IS'].astype(self.intensity_dtype, copy=False)
+        self.marker = columns['Marker'].astype(self.intensity_dtype, copy=False)
     
+    # the input columns as read, by their names in the input file
+    def input_columns(self) -> dict[str, np.ndarray]:
+        return {'Time (min)': self.time, 'Isomer 57': self.isoA, 'Isomer 77': self.isoB,
+                'IS': self.int_stand, 'Marker': self.marker}
+
+    # first cheap pass over the input file for the IS and Marker means
+    def scan_means(self, filepath: str, chunk_size: int = 100_000) -> tuple[float, float]:
+        sums = np.zeros(2)
+        counts = np.zeros(2)
+        for chunk in iter_input_chunks(filepath, chunk_size):
+            for j, col in enumerate(('IS', 'Marker')):
+                valid = ~np.isnan(chunk[col])
+                sums[j] += chunk[col][valid].sum()
+                counts[j] += valid.sum()
+        return sums[0] / counts[0], sums[1] / counts[1]
+
+    # stream the input file and yield finished peaks as they are found, so memory depends on
+    # chunk_size rather than file size. Means are taken from a first pass unless given.
+    def iter_peaks(self, filepath: str, marker_present: bool, chunk_size: int = 100_000,
+                   int_stand_mean: float | None = None, marker_mean: float | None = None) -> Iterator[PeakTable]:
+        if int_stand_mean is None or (marker_present and marker_mean is None):
+            scanned_int_stand, scanned_marker = self.scan_means(filepath, chunk_size)
+            int_stand_mean = scanned_int_stand if int_stand_mean is None else int_stand_mean
+            marker_mean = scanned_marker if marker_mean is None else marker_mean
+        self.marker_mean = marker_mean
+
+        self.total_duration = 0
+        self.num_durations = 0
+        self.num_samples = 0
+        detector = PeakDetector(int_stand_mean, marker_mean, marker_present)
+        for chunk in iter_input_chunks(filepath, chunk_size):
+            peaks = detector.feed(chunk)
+            self.num_samples += chunk['Time (min)'].size
+            self.total_duration = detector.total_duration
+            self.num_durations = detector.num_durations
+            if len(peaks):
+                yield peaks
+
+    # same result as read_data + process_peaks without holding the whole trace in memory
+    def process_peaks_streaming(self, filepath: str, marker_present: bool, chunk_size: int = 100_000,
+                                int_stand_mean: float | None = None, marker_mean: float | None = None) -> None:
+        tables = list(self.iter_peaks(filepath, marker_present, chunk_size, int_stand_mean, marker_mean))
+        self.peaks = PeakTable.concat(tables)
+
     # get time of peak, peak duration, and intensities
     def process_peaks(self, marker_present: bool) -> None:
-        int_stand_mean: float = np.nanmean(self.int_stand)
+        self.find_peaks()
+        self.find_row_starts(marker_present)
+
+    # peaks and their mean marker, without deciding which ones start a row
+    def find_peaks(self) -> None:
+        self.total_duration = 0
+        self.num_durations = 0
+        self.marker_mean = np.nanmean(self.marker)
+        if self.engine == "python":
+            self._process_peaks_python()
+        elif self.engine == "parallel":
+            self._process_peaks_parallel()
+        elif self.engine == "numba":
+            self._process_peaks_numba()
+        else:
+            self._process_peaks_numpy()
+
+    # IS level a sample has to be above to be part of a peak
+    def peak_threshold(self) -> float:
+        return np.nanmean(self.int_stand) * THRESHOLD_FRACTION
+
+    # a peak starts a row when its mean marker is above the run's mean marker
+    def find_row_starts(self, marker_present: bool) -> None:
         if marker_present:
-            marker_mean: float = np.nanmean(self.marker)
-        peakInd = np.where(self.int_stand > (int_stand_mean / 4), 1, 0)
+            self.peaks.is_start_of_row = self.peaks.marker > self.marker_mean
+        else:
+            self.peaks.is_start_of_row = np.zeros(len(self.peaks), dtype=bool)
+    
+    # find every peak at once from the threshold mask
+    def _process_peaks_numpy(self) -> None:
+        starts, ends = find_peak_bounds(self.int_stand > self.peak_threshold())
+        counts = ends - starts + 1
+        durations = self.time[ends] - self.time[starts]
+        peak_centers = (self.time[ends] + self.time[starts]) / 2
+        mean_intensity_a = sum_over_peaks(self.isoA, starts, ends) / counts
+        mean_intensity_b = sum_over_peaks(self.isoB, starts, ends) / counts
+        mean_int_stand = sum_over_peaks(self.int_stand, starts, ends) / counts
+        mean_marker = sum_over_peaks(self.marker, starts, ends) / counts
+        
+        self.num_durations += starts.size
+        self.total_duration += durations.sum()
+        self.peaks = PeakTable(np.arange(1, starts.size + 1), peak_centers, durations, mean_intensity_a,
+                               mean_intensity_b, mean_int_stand, mean_marker, np.zeros(starts.size, dtype=bool))
+    
+    # Same peaks as the numpy engine, found by a process pool. The trace is cut at samples
+    # below threshold into one piece per worker, the columns are put in shared memory once,
+    # and each worker searches its own piece; the pieces come back in order and are numbered
+    # as one run.
+    def _process_peaks_parallel(self) -> None:
+        num_chunks = min(self.workers, self.time.size // PARALLEL_CHUNK_SAMPLES)
+        if num_chunks < 2:
+            self._process_peaks_numpy()
+            return
+        threshold = self.peak_threshold()
+        cuts = find_gap_cuts(self.int_stand, threshold, num_chunks)
+        # neighbouring pieces share their cut sample so the piece on the left sees its last peak end
+        bounds = [(start, stop + 1) for start, stop in zip(cuts, cuts[1:])] + [(cuts[-1], self.time.size)]
+        value_columns = ['Isomer 57', 'Isomer 77', 'IS', 'Marker']
+        if self.trace_store is not None:
+            # every worker maps the store itself, nothing is copied
+            block, source = None, self.trace_store
+        else:
+            block, layout = share_columns(self.input_columns())
+            source = (block.name, layout)
+        try:
+            with ProcessPoolExecutor(max_workers=len(bounds)) as pool:
+                futures = [pool.submit(find_peaks_in_slice, source, start, stop, threshold, value_columns)
+                           for start, stop in bounds]
+                pieces = [future.result() for future in futures]
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+        durations = np.concatenate([piece[0] for piece in pieces])
+        peak_centers = np.concatenate([piece[1] for piece in pieces])
+        means = np.concatenate([piece[2] for piece in pieces], axis=1)
+
+        # totals over the whole run, summed the way the numpy engine sums them
+        self.num_durations += durations.size
+        self.total_duration += durations.sum()
+        self.peaks = PeakTable(np.arange(1, durations.size + 1), peak_centers, durations, *means,
+                               np.zeros(durations.size, dtype=bool))
+    
+    # the legacy loop compiled by numba, one pass over the samples
+    def _process_peaks_numba(self) -> None:
+        threshold = self.peak_threshold()
+        # plain ndarrays, numba does not take memmaps
+        values = tuple(np.asarray(values) for values in (self.isoA, self.isoB, self.int_stand, self.marker))
+        durations, peak_centers, means = numbaKernels.peak_means(np.asarray(self.time), np.asarray(self.int_stand),
+                                                                 threshold, values)
+        self.num_durations += durations.size
+        self.total_duration += durations.sum()
+        self.peaks = PeakTable(np.arange(1, durations.size + 1), peak_centers, durations, *means,
+                               np.zeros(durations.size, dtype=bool))
+    
+    # original sample-by-sample loop
+    def _process_peaks_python(self) -> None:
+        peakInd = np.where(self.int_stand > self.peak_threshold(), 1, 0)
+        # samples are summed as python floats, so float32 columns are still summed in float64
         count = 0
         intensityA = 0
         intensityB = 0
+        internal_standard = 0
         marker = 0
+        peak_centers, durations, intensities_a, intensities_b, int_stand_means, marker_means = [], [], [], [], [], []
         
         for i in range(1, peakInd.size - 1):
             # start of peak
             if peakInd[i] and not peakInd[i - 1]:
                 count = 1
-                marker = self.marker[i]
-                intensityA = self.isoA[i]
-                intensityB = self.isoB[i]   
-                internal_standard = self.int_stand[i]
+                marker = float(self.marker[i])
+                intensityA = float(self.isoA[i])
+                intensityB = float(self.isoB[i])   
+                internal_standard = float(self.int_stand[i])
             
             # inside of peak
             elif peakInd[i] and peakInd[i - 1]:
                 count += 1
-                marker += self.marker[i]
-                intensityA += self.isoA[i]
-                intensityB += self.isoB[i]
-                internal_standard += self.int_stand[i]
+                marker += float(self.marker[i])
+                intensityA += float(self.isoA[i])
+                intensityB += float(self.isoB[i])
+                internal_standard += float(self.int_stand[i])
             
             # end of peak
             if peakInd[i] and not peakInd[i + 1]:
-                mean_intensity_a = intensityA / count
-                mean_intensity_b = intensityB / count
-                mean_int_stand = internal_standard / count
+                intensities_a.append(intensityA / count)
+                intensities_b.append(intensityB / count)
+                int_stand_means.append(internal_standard / count)
                 duration = self.time[i] - self.time[i - count + 1]
                 self.num_durations += 1
                 self.total_duration += duration
-                peak_center = (self.time[i] + self.time[i - count + 1]) / 2
-                is_new_row = marker_present and (marker / count) > marker_mean
-                peak = Peak(len(self.peaks) + 1, peak_center, duration, mean_intensity_a, mean_intensity_b, mean_int_stand, is_new_row)
-                self.peaks.append(peak)
+                durations.append(duration)
+                peak_centers.append((self.time[i] + self.time[i - count + 1]) / 2)
+                marker_means.append(marker / count)
+
+        self.peaks = PeakTable(np.arange(1, len(durations) + 1), np.array(peak_centers, dtype=np.float64),
+                               np.array(durations, dtype=np.float64), np.array(intensities_a, dtype=np.float64),
+                               np.array(intensities_b, dtype=np.float64), np.array(int_stand_means, dtype=np.float64),
+                               np.array(marker_means, dtype=np.float64), np.zeros(len(durations), dtype=bool))
     
     # find potential split or merged peaks
     def find_irregulars(self) -> None:
         mean_duration = self.total_duration / self.num_durations
-        for peak in self.peaks:
-            if peak.duration > 1.5 * mean_duration:
-                self.potential_merged.append(peak.peak_number)
-            elif peak.duration < 0.55 * mean_duration:
-                self.potential_split.append(peak.peak_number)
+        merged, split = flag_irregulars(self.peaks.duration, mean_duration)
+        self.potential_merged = self.peaks.peak_number[merged]
+        self.potential_split = self.peaks.peak_number[split]
     
     # calibrate the data with the minimum reading for each isomer            
     def calibrate_data(self) -> None:
-        min_intensityA = min(peak.intensityA for peak in self.peaks)
-        min_intensityB = min(peak.intensityB for peak in self.peaks)
-
-        for peak in self.peaks:
-            peak.intensityA = peak.intensityA - min_intensityA
-            peak.intensityB = peak.intensityB - min_intensityB
+        self.peaks.intensityA = self.peaks.intensityA - np.nanmin(self.peaks.intensityA)
+        self.peaks.intensityB = self.peaks.intensityB - np.nanmin(self.peaks.intensityB)
             
             
-    # create well list
+    # wells are only known when the marker shows where rows start
+    def clear_well_list(self) -> None:
+        self.wells = None
+
+    # well of every peak, see WellIndex
     def create_well_list(self, num_rows, num_cols, num_droplets) -> None:
-        self.well_list = []
-        letters = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O']
-        
-        letter_index = num_rows - 1
-        well_number = num_cols
-        
-        for i in range(len(self.peaks)):
-            
-            if i > 0 and self.peaks[i].is_start_of_row and not self.peaks[i-1].is_start_of_row:
-                # what to do when encounter new row
-                if letter_index == 0:
-                    letter_index = num_rows - 1
-                else:
-                    letter_index -= 1
-                well_number = num_cols
-                position = letters[letter_index] + str(well_number)
-                self.well_list.append(position)
-                continue
-            
-            if i % num_droplets == 0 and i != 0:
-                # after a well, we want to move to the next well
-                well_number -= 1
-                
-            position = letters[letter_index] + str(well_number)
-            self.well_list.append(position)
+        if self.engine == "numba":
+            rows, well_numbers = numbaKernels.walk_wells(self.peaks.is_start_of_row, num_rows, num_cols, num_droplets)
+            self.wells = WellIndex.from_positions(rows, well_numbers, num_rows)
+        else:
+            self.wells = WellIndex.assign(self.peaks.is_start_of_row, num_rows, num_cols, num_droplets)
+
+    # well label of every peak, or None when wells were not assigned
+    @property
+    def well_list(self) -> np.ndarray | None:
+        return None if self.wells is None else self.wells.labels()
     
     # read out data
     
-    def write_data(self, selections, folder_path, output_filename):
-        
-        data_out = [asdict(peak) for peak in self.peaks]
-
-        df_out = pd.DataFrame(data_out)
-        df_out.drop(columns=['is_start_of_row'], inplace=True)
-        df_out['ratio'] = df_out['intensityA'] / (df_out['intensityA'] + df_out['intensityB'])
-        df_out['yield'] = (df_out['intensityA'] + df_out['intensityB']) / df_out['internal_standard']
-        df_out['isoA / internal_standard ratio'] = df_out['intensityA'] / df_out['internal_standard']
-        df_out['isoB / internal_standard ratio'] = df_out['intensityB'] / df_out['internal_standard']
-        df_out = df_out.round(3)
-        padded_list = self.potential_merged + [None] * (len(df_out) - len(self.potential_merged))
-        df_out['potential_merged'] = padded_list
-        padded_list = self.potential_split + [None] * (len(df_out) - len(self.potential_split))
-        df_out['potential_split'] = padded_list
-        df_out['well'] = self.well_list
-        df_out[['intensityA', 'intensityB', 'internal_standard']] = df_out[['intensityA', 'intensityB', 'internal_standard']].round(0)
-        labels = ['peak_number', 'peak_center', 'duration', 'intensityA', 'intensityB', 'internal_standard',
-                  'ratio', 'yield', 'isoA / internal_standard ratio',
-                  'isoB / internal_standard ratio', 'potential_merged', 'potential_split', 'well']
-
-        for i in range(len(selections)):
-            df_out.drop(columns=[labels[i]], inplace=True)
-            
-        output_filepath = os.path.join(folder_path, output_filename)
-        df_out.to_excel(output_filepath, index=False, engine='openpyxl')
+    # one of ratio, yield, isoA / internal_standard ratio, isoB / internal_standard ratio of every peak
+    def derived_column(self, name: str) -> np.ndarray:
+        peaks = self.peaks
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if name == 'ratio':
+                return peaks.intensityA / (peaks.intensityA + peaks.intensityB)
+            if name == 'yield':
+                return (peaks.intensityA + peaks.intensityB) / peaks.internal_standard
+            if name == 'isoA / internal_standard ratio':
+                return peaks.intensityA / peaks.internal_standard
+            if name == 'isoB / internal_standard ratio':
+                return peaks.intensityB / peaks.internal_standard
+        raise ValueError(f"{name!r} is not a derived column")
+
+    # the selected output columns in the order and rounding of the written file, all of them
+    # when columns is None. Columns that are not selected are never computed.
+    def build_output_table(self, columns: list[str] | None = None) -> dict:
+        peaks = self.peaks
+        builders = {
+            'peak_number': lambda: peaks.peak_number,
+            'peak_center': lambda: peaks.peak_center.round(3),
+            'duration': lambda: peaks.duration.round(3),
+            'intensityA': lambda: peaks.intensityA.round(3).round(0),
+            'intensityB': lambda: peaks.intensityB.round(3).round(0),
+            'internal_standard': lambda: peaks.internal_standard.round(3).round(0),
+            'potential_merged': lambda: pad_peak_numbers(self.potential_merged, len(peaks)),
+            'potential_split': lambda: pad_peak_numbers(self.potential_split, len(peaks)),
+            'well': lambda: self.well_list,
+        }
+        for name in DERIVED_COLUMNS:
+            builders[name] = lambda name=name: self.derived_column(name).round(3)
+
+        if columns is None:
+            columns = OUTPUT_COLUMNS
+        unknown = [name for name in columns if name not in builders]
+        if unknown:
+            raise ValueError(f"unknown output columns {unknown}, expected some of {OUTPUT_COLUMNS}")
+        return {name: builders[name]() for name in OUTPUT_COLUMNS if name in columns}
+
+    # One row per occupied well: droplet count, flagged droplets, and the mean, median, CV,
+    # min and max over the well's droplets of every heatmap channel in columns (all when None)
+    def build_well_summary(self, columns: list[str] | None = None) -> dict:
+        num_wells = self.wells.num_wells
+        merged = np.isin(self.peaks.peak_number, self.potential_merged)
+        split = np.isin(self.peaks.peak_number, self.potential_split)
+        table = {
+            "well": self.wells.well_labels(np.arange(num_wells)),
+            "droplets": np.diff(self.wells.offsets),
+            "potential_merged": np.bincount(self.wells.well_id[merged], minlength=num_wells),
+            "potential_split": np.bincount(self.wells.well_id[split], minlength=num_wells),
+        }
+        values, names = self.heatmap_channels(columns)
+        stats = self.wells.well_stats(values)
+        for j, name in enumerate(names):
+            for stat, per_well in stats.items():
+                table[f"{name} {stat}"] = per_well[:, j].round(3)
+        return table
+
+    # droplet table with the selected columns, plus the per-well summary of the selected channels
+    # when wells were assigned and any channel is selected
+    def write_data(self, columns: list[str] | None, folder_path, output_filename, output_format: str = "xlsx") -> str:
+        tables = {"Sheet1": self.build_output_table(columns)}
+        if self.wells is not None and (columns is None or any(name in HEATMAP_CHANNELS for name in columns)):
+            tables["Wells"] = self.build_well_summary(columns)
+        self.output_filepath = write_tables(tables, folder_path, output_filename, output_format)
+        return self.output_filepath
         
-    def create_heatmap_array(self, rows: int, cols: int, num_droplets: int) -> list[list[float]]:
-        self.peaks[:] = self.peaks[::-1]
-        intensity_per_well = []
-        row = []
-        for i, peak in enumerate(self.peaks):
-            if len(intensity_per_well) == rows:
-                return intensity_per_well
-            
-            if (i % num_droplets == 1):
-                row.append(peak.intensityA)                    
-            if (i % (cols * num_droplets) == cols * num_droplets - 1):
-                intensity_per_well.append(row)
-                row = []
-        intensity_per_well = list(map(list, zip(*intensity_per_well)))
-        return intensity_per_well
+    # the heatmap channels in names (every one when None) as one column per channel, named like
+    # the output columns. Channels that are not asked for are never computed.
+    def heatmap_channels(self, names: list[str] | None = None) -> tuple[np.ndarray, list[str]]:
+        peaks = self.peaks
+        names = HEATMAP_CHANNELS if names is None else [name for name in HEATMAP_CHANNELS if name in names]
+        measured = {'intensityA': peaks.intensityA, 'intensityB': peaks.intensityB,
+                    'internal_standard': peaks.internal_standard}
+        values = np.empty((len(peaks), len(names)))
+        for j, name in enumerate(names):
+            values[:, j] = measured[name] if name in measured else self.derived_column(name)
+        return values, list(names)
+
+    # heatmap of every channel at once, shape (rows, cols, channels), see heatmap_cube
+    def create_heatmap_cube(self, rows: int, cols: int, num_droplets: int) -> tuple[np.ndarray, list[str]]:
+        values, names = self.heatmap_channels()
+        return heatmap_cube(values, rows, cols, num_droplets), names
+
+    # intensityA laid out (cols, rows) the way pg.ImageItem draws it
+    def create_heatmap_array(self, rows: int, cols: int, num_droplets: int) -> np.ndarray:
+        cube, names = self.create_heatmap_cube(rows, cols, num_droplets)
+        return cube[:, :, names.index('intensityA')].T
         
     def run_all(self, filepath: str, marker_present: bool, num_rows: int, num_cols: int, 
-                num_droplets: int, selections: list[int], folder_path: str, output_filename: str) -> None:
-        self.read_data(filepath)
-        self.process_peaks(marker_present)
-        self.find_irregulars()
-        self.calibrate_data()
+                num_droplets: int, columns: list[str] | None = None, folder_path: str | None = None,
+                output_filename: str | None = None,
+                output_format: str = "xlsx", chunk_size: int | None = None,
+                progress: Callable[[str, int, int], None] | None = None,
+                report: StageReport | None = None, results: ResultsStore | None = None) -> AnalysisResult:
+        if (folder_path is None) != (output_filename is None):
+            raise ValueError("folder_path and output_filename are given together, or neither to skip writing")
+        if chunk_size:
+            # the streaming reader finds peaks while it reads
+            stages = [("peaks", (file_signature(filepath), chunk_size), [],
+                       lambda: self.process_peaks_streaming(filepath, False, chunk_size))]
+        else:
+            stages = [("read", file_signature(filepath), [], lambda: self.read_data(filepath)),
+                      ("peaks", self.engine, ["read"], self.find_peaks)]
+        stages.append(("rows", marker_present, ["peaks"], lambda: self.find_row_starts(marker_present)))
+        stages.append(("irregulars", (), ["peaks"], self.find_irregulars))
+        stages.append(("calibrate", (), ["peaks"], self.calibrate_data))
         if marker_present:
-            self.create_well_list(num_rows, num_cols, num_droplets)
-        self.write_data(selections, folder_path, output_filename)
-            
\ No newline at end of file
+            wells = lambda: self.create_well_list(num_rows, num_cols, num_droplets)
+        else:
+            wells = self.clear_well_list
+        stages.append(("wells", (marker_present, num_rows, num_cols, num_droplets), ["rows"], wells))
+        if folder_path is None:
+            self.output_filepath = None
+        else:
+            # the output is always written, its file may have been moved or deleted since
+            stages.append(("write", None, ["irregulars", "calibrate", "wells"],
+                           lambda: self.write_data(columns, folder_path, output_filename, output_format)))
+
+        if results is not None:
+            # added once per distinct result, re-running unchanged stages adds nothing
+            stages.append(("results", results.db_path, ["irregulars", "calibrate", "wells"],
+                           lambda: self.store_results(results, filepath, marker_present, num_rows, num_cols,
+                                                      num_droplets)))
+
+        stale = self.stale_stages(stages)
+        self.run_stages(stale, progress, report)
+        if report is not None:
+            ran = [name for name, _ in stale]
+            report.info.update(input=os.path.abspath(filepath), output=self.output_filepath,
+                               reused=[stage[0] for stage in stages if stage[0] not in ran])
+            if self.output_filepath is not None:
+                report.write_json(self.output_filepath)
+
+        heatmap_cube, heatmap_names = self.heatmap(num_rows, num_cols, num_droplets) if marker_present else (None, [])
+        # its own table object, re-run stages set new arrays on self.peaks instead of changing them
+        return AnalysisResult(self.peaks[:], self.potential_merged, self.potential_split, self.wells,
+                              heatmap_cube, heatmap_names, self.output_filepath)
+
+    # add the peaks of the last run and every heatmap channel to a results store, see resultsStore.py
+    def store_results(self, results: ResultsStore, filepath: str, marker_present: bool, num_rows: int,
+                      num_cols: int, num_droplets: int) -> int:
+        path, size, mtime_ns = file_signature(filepath)
+        # a store made by convert_to_trace_store names the export it was parsed from
+        source = read_header(filepath).get('source') if is_trace_store(filepath) else None
+        if source:
+            path, size, mtime_ns = source['path'], source['size'], source['mtime_ns']
+        info = {'input': path, 'input_size': size, 'input_mtime_ns': mtime_ns, 'output': self.output_filepath,
+                'engine': self.engine, 'marker_present': marker_present, 'num_rows': num_rows,
+                'num_cols': num_cols, 'num_droplets': num_droplets}
+        peaks = {'peak_number': self.peaks.peak_number, 'peak_center': self.peaks.peak_center,
+                 'duration': self.peaks.duration, 'well': self.well_list,
+                 'potential_merged': self.potential_merged, 'potential_split': self.potential_split}
+        values, names = self.heatmap_channels()
+        self.results_run_id = results.add_run(info, peaks, values, names)
+        return self.results_run_id
+
+    # heatmap cube and channel names of the last run, rebuilt only when the layout or peaks changed
+    def heatmap(self, rows: int, cols: int, num_droplets: int) -> tuple[np.ndarray, list[str]]:
+        def build() -> None:
+            self.heatmap_cube, self.heatmap_names = self.create_heatmap_cube(rows, cols, num_droplets)
+        self.run_stages(self.stale_stages([("heatmap", (rows, cols, num_droplets), ["calibrate"], build)]))
+        return self.heatmap_cube, self.heatmap_names
+
+    # Stages are (name, params, depends_on, function). A stage's key is its params, the keys
+    # of the stages it depends on and a run number, so every stage downstream of one that
+    # runs again runs too. Returns the (name, function) pairs whose inputs changed since they
+    # last ran, or whose params are None; each records its key once it finishes.
+    def stale_stages(self, stages: list[tuple[str, object, list[str], Callable[[], None]]]
+                     ) -> list[tuple[str, Callable[[], None]]]:
+        keys = dict(self.stage_keys)
+        stale = []
+        for name, params, depends_on, run_stage in stages:
+            inputs = (params, tuple(keys.get(dep) for dep in depends_on))
+            if params is not None and name in self.stage_keys and self.stage_keys[name][:2] == inputs:
+                continue
+            self.stage_runs += 1
+            keys[name] = inputs + (self.stage_runs,)
+            stale.append((name, self._keyed_stage(name, keys[name], run_stage)))
+        return stale
+
+    def _keyed_stage(self, name: str, key: tuple, run_stage: Callable[[], None]) -> Callable[[], None]:
+        def run() -> None:
+            # forgotten first, a stage that fails part way must run again next time
+            self.stage_keys.pop(name, None)
+            run_stage()
+            self.stage_keys[name] = key
+        return run
+
+    # run (name, function) stages in order. progress is called with the stage name, its
+    # index and the stage count before each stage, and with "done" at the end. With a
+    # report every stage is timed and its row counts recorded.
+    def run_stages(self, stages: list[tuple[str, Callable[[], None]]],
+                   progress: Callable[[str, int, int], None] | None = None,
+                   report: StageReport | None = None) -> None:
+        try:
+            for i, (name, run_stage) in enumerate(stages):
+                if self.cancel_requested:
+                    raise AnalysisCancelled(name)
+                if progress is not None:
+                    progress(name, i, len(stages))
+                if report is None:
+                    run_stage()
+                else:
+                    report.measure(name, run_stage, lambda: self.stage_rows(name))
+        finally:
+            self.cancel_requested = False
+        if progress is not None:
+            progress("done", len(stages), len(stages))
+
+    # (rows in, rows out) of a finished stage: samples, peaks, flagged peaks or labelled wells
+    def stage_rows(self, name: str) -> tuple[int | None, int | None]:
+        num_peaks = None if self.peaks is None else len(self.peaks)
+        if name == "read":
+            return None, self.num_samples
+        if name == "peaks":
+            return self.num_samples, num_peaks
+        if name == "rows":
+            return num_peaks, None if self.peaks is None else int(np.count_nonzero(self.peaks.is_start_of_row))
+        if name == "irregulars":
+            return num_peaks, self.potential_merged.size + self.potential_split.size
+        if name == "wells":
+            return num_peaks, None if self.wells is None else len(self.wells)
+        return num_peaks, num_peaks
+
+    # stop a running run_all at the next stage boundary, safe to call from another thread
+    def cancel(self) -> None:
+        self.cancel_requested = True
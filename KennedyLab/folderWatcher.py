@@ -0,0 +1,198 @@
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future
+from batch import AnalysisPool, analyze_file, exit_on_sigterm, future_result, is_input_file
+from inputCache import file_hash
+
+# Watches the folders an instrument exports into and analyzes every new run file once it is
+# completely written. The config file names the folders and the analyze_file settings of
+# each; folder paths are relative to the config file:
+#
+#   {"defaults": {"output_dir": "results", "output_format": "xlsx"},
+#    "folders": {"plates96": {"num_rows": 8, "num_cols": 12, "num_droplets": 3, "marker_present": true},
+#                "plates384": {"num_rows": 16, "num_cols": 24, "num_droplets": 3, "marker_present": true}}}
+#
+# Every file analyzed is recorded in a ledger by content hash, so a copy of a file already
+# done, or a restart of the watcher, does not analyze anything twice.
+
+def read_config(config_path: str) -> dict[str, dict]:
+    with open(config_path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(config_path))
+    defaults = config.get("defaults", {})
+    folders = {}
+    for folder, settings in config["folders"].items():
+        settings = {**defaults, **settings}
+        if settings.get("output_dir"):
+            settings["output_dir"] = os.path.join(base, settings["output_dir"])
+        try:
+            inspect.signature(analyze_file).bind("", **settings)
+        except TypeError as e:
+            raise ValueError(f"settings of {folder} in {config_path}: {e}") from None
+        folders[os.path.normpath(os.path.join(base, folder))] = settings
+    return folders
+
+# Every file the watcher has finished with, one JSON line each, appended as they finish so
+# nothing is lost when the watcher stops. Files are known by content hash; the path, size
+# and mtime each was seen with are kept too so an unchanged file is not hashed again.
+class Ledger:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hashes: dict[str, dict] = {}
+        self.signatures: set[tuple[str, int, int]] = set()
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._remember(json.loads(line))
+                    except ValueError:
+                        # a line cut short when the watcher was killed
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def _remember(self, entry: dict) -> None:
+        # content that failed is tried again when it turns up under another name
+        if entry["state"] == "done":
+            self.hashes.setdefault(entry["hash"], entry)
+        self.signatures.add((entry["path"], entry["size"], entry["mtime_ns"]))
+
+    def seen(self, path: str, size: int, mtime_ns: int) -> bool:
+        return (path, size, mtime_ns) in self.signatures
+
+    def add(self, entry: dict) -> None:
+        self._remember(entry)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+class FolderWatcher:
+
+    def __init__(self, folders: dict[str, dict], ledger: Ledger, workers: int | None = None,
+                 settle_seconds: float = 5.0):
+        self.folders = folders
+        self.ledger = ledger
+        self.settle_seconds = settle_seconds
+        self.pool = AnalysisPool(workers)
+        # path -> (size, mtime_ns, when it was first seen at that size and mtime)
+        self.changing: dict[str, tuple[int, int, float]] = {}
+        # future -> ledger entry of the file it analyzes
+        self.running: dict[Future, dict] = {}
+
+    # Files that have not changed for settle_seconds and are not in the ledger. A file still
+    # being written keeps changing size or mtime, so it waits until the instrument is done.
+    def find_ready(self) -> list[tuple[str, os.stat_result, dict]]:
+        now = time.monotonic()
+        running = {entry["path"] for entry in self.running.values()}
+        ready = []
+        for folder, settings in self.folders.items():
+            try:
+                names = sorted(os.listdir(folder))
+            except FileNotFoundError:
+                continue
+            for name in filter(is_input_file, names):
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if path in running or self.ledger.seen(path, stat.st_size, stat.st_mtime_ns):
+                    self.changing.pop(path, None)
+                    continue
+                first_seen = self.changing.get(path)
+                if first_seen is None or first_seen[:2] != (stat.st_size, stat.st_mtime_ns):
+                    self.changing[path] = (stat.st_size, stat.st_mtime_ns, now)
+                elif now - first_seen[2] >= self.settle_seconds:
+                    del self.changing[path]
+                    ready.append((path, stat, settings))
+        return ready
+
+    # Hash the ready files and hand the ones with new content to the pool. A copy of content
+    # that is still being analyzed waits: it is a duplicate once that run is done, and is
+    # analyzed itself if that run fails.
+    def dispatch(self, ready: list[tuple[str, os.stat_result, dict]]) -> int:
+        in_flight = {entry["hash"] for entry in self.running.values()}
+        dispatched = 0
+        for path, stat, settings in ready:
+            entry = {"hash": file_hash(path), "path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            if entry["hash"] in self.ledger.hashes:
+                self.ledger.add({**entry, "state": "duplicate", "time": time.time()})
+                print(f"{path}: same content as a file already analyzed, skipped", flush=True)
+                continue
+            if entry["hash"] in in_flight:
+                # seen again by find_ready and settled again after the run finishes
+                continue
+            in_flight.add(entry["hash"])
+            self.running[self.pool.submit(filepath=path, **settings)] = entry
+            dispatched += 1
+        return dispatched
+
+    # record the files the pool has finished with
+    def collect(self) -> int:
+        finished = [future for future in self.running if future.done()]
+        for future in finished:
+            entry = self.running.pop(future)
+            if future.cancelled():
+                # left out of the ledger, it is analyzed after a restart
+                continue
+            result = future_result(future, entry["path"])
+            self.ledger.add({**entry, "state": "done" if result["error"] is None else "failed",
+                             "output": result["output"], "error": result["error"], "time": time.time()})
+            if result["error"] is None:
+                print(f"{entry['path']}: {result['peaks']} peaks -> {result['output']}", flush=True)
+            else:
+                print(f"{entry['path']}: {result['error']}", file=sys.stderr, flush=True)
+        return len(finished)
+
+    def poll(self) -> None:
+        self.collect()
+        self.dispatch(self.find_ready())
+
+    # poll until stopped, or with once until every file present at the start is done
+    def run(self, interval: float = 2.0, once: bool = False) -> None:
+        try:
+            while True:
+                self.poll()
+                if once and not self.changing and not self.running:
+                    return
+                time.sleep(interval)
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.collect()
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Analyze every new run file that appears in the configured folders.")
+    parser.add_argument("config", help="JSON file naming the watched folders and their plate settings")
+    parser.add_argument("--ledger", default=None,
+                        help="record of the files already analyzed (default: <config>.ledger.jsonl)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between looks at the folders")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="seconds a file must stay unchanged before it counts as completely written")
+    parser.add_argument("--once", action="store_true", help="analyze the files there now, then exit")
+    args = parser.parse_args(argv)
+
+    try:
+        folders = read_config(args.config)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"cannot use {args.config}: {e}")
+    for settings in folders.values():
+        if settings.get("output_dir"):
+            os.makedirs(settings["output_dir"], exist_ok=True)
+    ledger = Ledger(args.ledger or os.path.splitext(args.config)[0] + ".ledger.jsonl")
+    watcher = FolderWatcher(folders, ledger, args.workers, args.settle)
+    exit_on_sigterm()
+    print(f"watching {len(folders)} folders, {len(ledger.hashes)} files already analyzed", flush=True)
+    try:
+        watcher.run(args.interval, args.once)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,13 +11,50 @@ from PySide6.QtWidgets import (
     QTextEdit,
     QLineEdit,
     QCheckBox,
+    QComboBox,
+    QProgressBar,
     QSizePolicy
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, Signal
 import pyqtgraph as pg
 import pyqtgraph.colormap as pcm
 import numpy as np
-from dataAnalyzer import DataAnalyzer
+import os
+from dataAnalyzer import DataAnalyzer, AnalysisCancelled, OUTPUT_COLUMNS
+from inputCache import InputCache
+from outputWriters import OUTPUT_WRITERS
+from stageReport import StageReport
+from liveRun import LiveRun
+from traceView import TraceView, MinMaxPyramid, build_trace
+
+# how often live mode looks for new rows in the export
+LIVE_POLL_MS = 1000
+
+# parsed copies of input files, so re-running the same file skips the Excel parse
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".dataAnalyzer_cache", "KennedyLab")
+
+class WorkerSignals(QObject):
+    progress = Signal(str, int, int)
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+# runs fn(progress) on the thread pool and reports back through signals
+class Worker(QRunnable):
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(self.signals.progress.emit)
+        except AnalysisCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(f"{type(e).__name__}: {e}")
+        else:
+            self.signals.finished.emit(result)
 
 class DataSuite(QMainWindow):
     def __init__(self):
@@ -26,6 +63,18 @@ class DataSuite(QMainWindow):
         self.setWindowTitle("Data Analytics Suite")
         self.setGeometry(150, 150, 1100, 200)
         self.setStyleSheet("background-color: #111111")
+        self.input_cache = InputCache(CACHE_DIR)
+        # kept between runs so changing only the layout or marker skips reading and peak finding
+        self.analyzer = DataAnalyzer(cache=self.input_cache)
+        self.worker = None
+        self.report = None
+        self.live_run = None
+        # the poll reading the export on the thread pool, None between polls
+        self.live_worker = None
+        self.heatmap_cube = None
+        self.live_timer = QTimer(self)
+        self.live_timer.setInterval(LIVE_POLL_MS)
+        self.live_timer.timeout.connect(self.poll_live)
         
         self.central_widget = QWidget()
         self.setCentralWidget(self.central_widget)
@@ -221,6 +270,12 @@ class DataSuite(QMainWindow):
         self.generate_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.output_file_name = QTextEdit("Output File Name")
         self.output_file_name.setFixedHeight(30)
+        self.output_format = QComboBox()
+        self.output_format.addItems(list(OUTPUT_WRITERS))
+        self.output_format.setStyleSheet("QComboBox"
+                                "{"
+                                "background : gray;"
+                                "}")
         
         self.output_folder_label = QLabel("No Folder Selected")
         self.output_folder_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -268,6 +323,66 @@ class DataSuite(QMainWindow):
         """
         )
         self.generate_button.clicked.connect(self.generate_results)
+        
+        self.live_button = QPushButton("Go Live")
+        self.live_button.setCheckable(True)
+        self.live_button.setStyleSheet(
+        """
+        QPushButton {
+            background-color: #0078D7;
+            margin-top: 10px;
+            border-radius: 8px;
+            padding: 8px;
+            color: white;
+            font-size: 15px;
+        }
+        QPushButton:hover {
+            background-color: #005FA3;
+        }
+        QPushButton:checked {
+            background-color: #B22222;
+        }
+        """
+        )
+        self.live_button.toggled.connect(self.toggle_live)
+        
+        self.progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("")
+        self.progress_bar.setStyleSheet("QProgressBar { margin-top: 10px; text-align: center; }")
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setStyleSheet(
+        """
+        QPushButton {
+            background-color: #0078D7;
+            margin-top: 10px;
+            margin-left: 5px;
+            border-radius: 8px;
+            padding: 8px;
+            color: white;
+            font-size: 15px;
+        }
+        QPushButton:hover {
+            background-color: #005FA3;
+        }
+        QPushButton:disabled {
+            background-color: #333333;
+        }
+        """
+        )
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_results)
+        self.progress_layout.addWidget(self.progress_bar)
+        self.progress_layout.addWidget(self.cancel_button)
+        self.status_label = QLabel("")
+        self.status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.status_label.setStyleSheet("font-size: 12px; margin-top: 5px;")
+        self.heatmap_channel = QComboBox()
+        self.heatmap_channel.setStyleSheet("QComboBox"
+                                "{"
+                                "background : gray;"
+                                "}")
+        self.heatmap_channel.currentIndexChanged.connect(self.draw_heatmap_channel)
         self.heatmap_spacer = QWidget()
         self.heatmap_spacer.setFixedHeight(20)
         self.third_col_spacer = QWidget()
@@ -278,10 +393,15 @@ class DataSuite(QMainWindow):
         
         self.third_col.addWidget(self.generate_label)
         self.third_col.addWidget(self.output_file_name)
+        self.third_col.addWidget(self.output_format)
         self.third_col.addWidget(self.output_folder_label)
         self.third_col.addWidget(self.output_folder_button)
         self.third_col.addWidget(self.generate_button)
+        self.third_col.addWidget(self.live_button)
+        self.third_col.addLayout(self.progress_layout)
+        self.third_col.addWidget(self.status_label)
         self.third_col.addWidget(self.heatmap_spacer)
+        self.third_col.addWidget(self.heatmap_channel)
         self.third_col.addWidget(self.view)
         # self.third_col.addWidget(self.third_col_spacer)
         
@@ -300,6 +420,27 @@ class DataSuite(QMainWindow):
         
         self.main_layout.addLayout(self.col_layout, stretch=2)
         self.main_layout.addWidget(self.spacer)
+        
+        ###########
+        ## RAW TRACE
+        ###########
+        self.trace_layout = QHBoxLayout()
+        self.trace_label = QLabel("Raw Trace")
+        self.trace_label.setStyleSheet("font-size: 26px; margin-bottom: 10px; padding: 2px; border-bottom: 2px solid #fff")
+        self.trace_isomer = QComboBox()
+        self.trace_isomer.setStyleSheet("QComboBox"
+                                "{"
+                                "background : gray;"
+                                "}")
+        self.trace_isomer.setFixedWidth(200)
+        self.trace_isomer.addItems(["Isomer 57", "Isomer 77"])
+        self.trace_isomer.currentIndexChanged.connect(self.draw_trace_isomer)
+        self.trace_layout.addWidget(self.trace_label)
+        self.trace_layout.addWidget(self.trace_isomer)
+        self.trace_view = TraceView()
+        self.trace_view.setMinimumHeight(250)
+        self.main_layout.addLayout(self.trace_layout)
+        self.main_layout.addWidget(self.trace_view, stretch=3)
         self.central_widget.setLayout(self.main_layout)
         self.central_widget.setStyleSheet("QWidget {color: white; }")
  
@@ -332,28 +473,176 @@ class DataSuite(QMainWindow):
         num_droplets = int(self.droplets_input.text())
         marker_present = self.marker_checkbox.isChecked()
         output_filename = self.output_file_name.toPlainText()
-        selections = []
+        output_format = self.output_format.currentText()
+        # the selection rows are in OUTPUT_COLUMNS order, only checked columns are written
+        columns = []
         
         for row in range(self.selection_layout.rowCount()):
             item = self.selection_layout.itemAtPosition(row, 1).widget()
-            if not item.isChecked():
-                selections.append(row)
-        
-        da = DataAnalyzer()
-        da.run_all(file_path, marker_present, num_rows, num_cols, num_droplets,
-                   selections, output_folder, output_filename)
-        
-        
-        arr_2d = da.create_heatmap_array(num_rows, num_cols, num_droplets)
-        arr_2d = np.array(arr_2d)
+            if item.isChecked():
+                columns.append(OUTPUT_COLUMNS[row])
+        
+        da = self.analyzer
+        # timing only, tracing memory would slow the read stage down several times
+        report = StageReport(trace_memory=False)
+        self.report = report
+        
+        trace_isomer = self.trace_isomer.currentText()
+        
+        def analyze(progress):
+            da.run_all(file_path, marker_present, num_rows, num_cols, num_droplets,
+                       columns, output_folder, output_filename, output_format, progress=progress,
+                       report=report)
+            return da.heatmap(num_rows, num_cols, num_droplets), self.trace_for_run(da, trace_isomer)
+        
+        self.start_worker(analyze)
+        
+    # run the analysis off the GUI thread, results come back through the worker signals
+    def start_worker(self, fn):
+        self.worker = Worker(fn)
+        self.worker.signals.progress.connect(self.show_progress)
+        self.worker.signals.finished.connect(self.show_results)
+        self.worker.signals.failed.connect(self.show_failure)
+        self.worker.signals.cancelled.connect(self.show_cancelled)
+        self.set_running(True)
+        self.status_label.setText("")
+        QThreadPool.globalInstance().start(self.worker)
+        
+    def cancel_results(self):
+        self.analyzer.cancel()
+        self.progress_bar.setFormat("Cancelling...")
+        
+    def set_running(self, running):
+        self.generate_button.setEnabled(not running)
+        self.live_button.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+        self.trace_isomer.setEnabled(not running)
+        
+    # follow an export that is still being written, updating the heatmap as droplets arrive
+    def toggle_live(self, checked):
+        if not checked:
+            self.live_timer.stop()
+            self.live_button.setText("Go Live")
+            self.generate_button.setEnabled(True)
+            return
+        try:
+            self.live_run = LiveRun(self.file_path_label.text(), self.marker_checkbox.isChecked(),
+                                    int(self.row_input.text()), int(self.col_input.text()),
+                                    int(self.droplets_input.text()))
+        except ValueError as e:
+            self.live_button.setChecked(False)
+            self.status_label.setText(str(e))
+            return
+        self.live_button.setText("Stop Live")
+        self.generate_button.setEnabled(False)
         self.view.clear()
         self.plot = self.view.addPlot()
-        self.img = pg.ImageItem(arr_2d)
+        self.img = pg.ImageItem(self.live_run.heatmap)
         color_map = pcm.getFromMatplotlib('gray')
         self.img.setLookupTable(color_map.getLookupTable())
         self.plot.addItem(self.img)
         self.plot.invertY(True)
-        
+        self.status_label.setText(self.live_run.summary())
+        self.live_timer.start()
+        
+    # Reading and peak finding run on the thread pool, catching up on a large export would
+    # freeze the window otherwise. A tick while the last poll is still running is skipped.
+    def poll_live(self):
+        if self.live_worker is not None:
+            return
+        live_run = self.live_run
+        self.live_worker = Worker(lambda progress: live_run.poll())
+        self.live_worker.signals.finished.connect(lambda new_peaks: self.show_live_poll(live_run, new_peaks))
+        self.live_worker.signals.failed.connect(lambda message: self.show_live_failure(live_run, message))
+        QThreadPool.globalInstance().start(self.live_worker)
+        
+    def show_live_poll(self, live_run, new_peaks):
+        self.live_worker = None
+        # live mode was stopped, or started again on another run, while the poll ran
+        if live_run is not self.live_run or not self.live_timer.isActive():
+            return
+        if new_peaks:
+            self.img.setImage(live_run.heatmap, autoLevels=True)
+        self.status_label.setText(live_run.summary())
+        
+    def show_live_failure(self, live_run, message):
+        self.live_worker = None
+        if live_run is self.live_run and self.live_timer.isActive():
+            self.live_button.setChecked(False)
+            self.status_label.setText(message)
+        
+    def show_progress(self, stage, index, total):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(index)
+        self.progress_bar.setFormat("Done" if stage == "done" else f"{stage}...")
+        
+    def show_failure(self, message):
+        self.set_running(False)
+        self.progress_bar.setFormat("Failed")
+        self.status_label.setText(message)
+        
+    def show_cancelled(self):
+        self.set_running(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("Cancelled")
+        
+    def show_results(self, result):
+        heatmap, trace = result
+        self.set_running(False)
+        self.status_label.setText(self.report.summary())
+        self.show_trace(trace)
+        if heatmap is None:
+            return
+        self.heatmap_cube, names = heatmap
+        # the picked channel stays picked when the new run has it
+        current = self.heatmap_channel.currentText()
+        self.heatmap_channel.blockSignals(True)
+        self.heatmap_channel.clear()
+        self.heatmap_channel.addItems(names)
+        if current in names:
+            self.heatmap_channel.setCurrentText(current)
+        self.heatmap_channel.blockSignals(False)
+        self.view.clear()
+        self.plot = self.view.addPlot()
+        self.img = pg.ImageItem()
+        color_map = pcm.getFromMatplotlib('gray')
+        self.img.setLookupTable(color_map.getLookupTable())
+        self.plot.addItem(self.img)
+        self.plot.invertY(True)
+        self.draw_heatmap_channel()
+        
+    # IS, Marker and one isomer of the run with its peaks, built on the worker thread since the
+    # decimation pyramids of a long run take a moment
+    def trace_for_run(self, da, isomer):
+        columns = da.input_columns()
+        channels = {name: columns[name] for name in ('IS', 'Marker', isomer) if name in columns}
+        flagged = {'potential_merged': da.potential_merged, 'potential_split': da.potential_split}
+        pyramids, spans = build_trace(da.time, channels, da.peaks.peak_center, da.peaks.duration, flagged)
+        return pyramids, da.peak_threshold(), spans
+        
+    def show_trace(self, trace):
+        pyramids, threshold, spans = trace
+        self.trace_view.set_trace(pyramids, threshold, spans)
+        
+    # another isomer in the trace panel, the peaks and the view stay as they are
+    def draw_trace_isomer(self):
+        isomer = self.trace_isomer.currentText()
+        columns = self.analyzer.input_columns() if self.analyzer.peaks is not None else {}
+        if isomer not in columns or not self.trace_view.pyramids:
+            return
+        pyramids = {name: pyramid for name, pyramid in self.trace_view.pyramids.items() if not name.startswith("Isomer")}
+        pyramids[isomer] = MinMaxPyramid(self.analyzer.time, columns[isomer])
+        self.trace_view.set_trace(pyramids, self.trace_view.threshold, self.trace_view.spans, keep_view=True)
+        
+    # switching channel only takes a slice of the heatmap cube, nothing is recomputed
+    def draw_heatmap_channel(self):
+        if self.heatmap_cube is None or self.heatmap_channel.currentIndex() < 0 or self.live_timer.isActive():
+            return
+        plane = self.heatmap_cube[:, :, self.heatmap_channel.currentIndex()].T
+        # empty wells and divisions by zero are drawn at the lowest value
+        finite = np.isfinite(plane)
+        low = plane[finite].min() if finite.any() else 0.0
+        self.img.setImage(np.where(finite, plane, low), autoLevels=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+import numpy as np
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+# hash of the file contents, read in blocks so large exports are never fully in memory
+def file_hash(filepath: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Parsed input columns stored as .npz files, one per distinct file content.
+# Entries are keyed by content hash; the path, size and mtime of the last file seen
+# with that content are kept so an unchanged file is found without hashing it again.
+# Once the cache holds more than max_bytes the least recently used entries are removed.
+# Several processes may share one cache: every change to the index is made under a lock
+# file, on the index as it is on disk at that moment.
+class InputCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = self.index_path + ".lock"
+        self.entries: dict[str, dict] = self._read_index()
+
+    def _read_index(self) -> dict[str, dict]:
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # written to a temporary file first so a crash never leaves a half written index
+    def _write_index(self) -> None:
+        tmp_path = self.index_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    # Read the index afresh and hold the lock while the caller changes self.entries; the
+    # changed index is written before the lock is let go, so no other process's entries are lost
+    @contextmanager
+    def _changing_index(self):
+        with open(self.lock_path, 'a+b') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            else:
+                lock.seek(0)
+                # retries for 10 s, then raises OSError
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                self.entries = self._read_index()
+                yield self.entries
+                self._write_index()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def key_for(self, filepath: str) -> str:
+        stat = os.stat(filepath)
+        path = os.path.abspath(filepath)
+        # other processes may have added entries since
+        self.entries = self._read_index()
+        for key, entry in self.entries.items():
+            if entry['path'] == path and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                return key
+        return file_hash(filepath)
+
+    # columns stored under key, or None on a miss. The entry is pointed at filepath
+    # so the next lookup of that file does not need to hash it.
+    def load(self, key: str, filepath: str) -> dict[str, np.ndarray] | None:
+        if key not in self.entries:
+            return None
+        try:
+            with np.load(self._data_path(key)) as data:
+                columns = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            with self._changing_index() as entries:
+                entries.pop(key, None)
+            return None
+        with self._changing_index() as entries:
+            # unless another process evicted it meanwhile
+            if key in entries:
+                entries[key].update(self._file_info(filepath))
+        return columns
+
+    def store(self, key: str, filepath: str, columns: dict[str, np.ndarray]) -> None:
+        data_path = self._data_path(key)
+        tmp_path = data_path + f".{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **columns)
+        os.replace(tmp_path, data_path)
+
+        with self._changing_index() as entries:
+            entries[key] = {'bytes': os.path.getsize(data_path), **self._file_info(filepath)}
+            self._evict(keep=key)
+
+    def _file_info(self, filepath: str) -> dict:
+        stat = os.stat(filepath)
+        return {
+            'path': os.path.abspath(filepath),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'last_used': time.time(),
+        }
+
+    # drop least recently used entries until the cache fits in max_bytes, called under the lock
+    def _evict(self, keep: str) -> None:
+        total = sum(entry['bytes'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)['bytes']
+            try:
+                os.remove(self._data_path(key))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        with self._changing_index() as entries:
+            for key in list(entries):
+                try:
+                    os.remove(self._data_path(key))
+                except OSError:
+                    pass
+            entries.clear()
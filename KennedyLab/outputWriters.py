@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from typing import Iterator
+import csv
+import os
+import openpyxl
+
+# The output table is an ordered dict of column name -> column values. A column is a
+# NumPy array, a pandas nullable integer array, a list, or None for an empty column.
+
+ROWS_PER_BLOCK = 10_000
+
+def num_rows(table: dict) -> int:
+    return max((len(values) for values in table.values() if values is not None), default=0)
+
+# plain Python values for rows start:stop of a column, with NaN and NA as None
+def _column_block(values, start: int, stop: int) -> list:
+    if values is None:
+        return [None] * (stop - start)
+    block = values[start:stop]
+    if isinstance(block, pd.api.extensions.ExtensionArray):
+        return block.to_numpy(dtype=object, na_value=None).tolist()
+    if isinstance(block, np.ndarray):
+        block = block.tolist()
+    return [None if isinstance(v, float) and v != v else v for v in block]
+
+# rows of the table, converted one block at a time so memory does not grow with the table
+def iter_rows(table: dict) -> Iterator[tuple]:
+    total = num_rows(table)
+    for start in range(0, total, ROWS_PER_BLOCK):
+        stop = min(start + ROWS_PER_BLOCK, total)
+        yield from zip(*(_column_block(values, start, stop) for values in table.values()))
+
+# Constant-memory xlsx with one sheet per table, in the order given; rows go straight to the
+# file through openpyxl's write-only mode
+def write_xlsx_sheets(tables: dict[str, dict], filepath: str) -> None:
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, table in tables.items():
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append(list(table))
+        for row in iter_rows(table):
+            sheet.append(row)
+    workbook.save(filepath)
+
+def write_csv(table: dict, filepath: str) -> None:
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(table))
+        writer.writerows(iter_rows(table))
+
+def write_parquet(table: dict, filepath: str) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)") from None
+    total = num_rows(table)
+    arrays = [pa.nulls(total) if values is None else pa.array(values, from_pandas=True) for values in table.values()]
+    pq.write_table(pa.Table.from_arrays(arrays, names=list(table)), filepath)
+
+# output format -> (writer, file extension). The xlsx writer takes every table at once, the
+# others one table per file.
+OUTPUT_WRITERS = {
+    "xlsx": (write_xlsx_sheets, ".xlsx"),
+    "csv": (write_csv, ".csv"),
+    "parquet": (write_parquet, ".parquet"),
+}
+
+# Write {sheet name: table}, the first table being the main output. xlsx gets one sheet per
+# table; other formats get one file per table, the extra ones named <output>_<sheet name>.
+# The format's extension is added if the file name has none. Returns the path of the main output.
+def write_tables(tables: dict[str, dict], folder_path: str, output_filename: str, output_format: str = "xlsx") -> str:
+    if output_format not in OUTPUT_WRITERS:
+        raise ValueError(f"output_format must be one of {list(OUTPUT_WRITERS)}, got {output_format!r}")
+    writer, extension = OUTPUT_WRITERS[output_format]
+    if not os.path.splitext(output_filename)[1]:
+        output_filename += extension
+    output_filepath = os.path.join(folder_path, output_filename)
+    if output_format == "xlsx":
+        writer(tables, output_filepath)
+        return output_filepath
+
+    stem, file_extension = os.path.splitext(output_filepath)
+    for i, (sheet_name, table) in enumerate(tables.items()):
+        writer(table, output_filepath if i == 0 else f"{stem}_{sheet_name.lower()}{file_extension}")
+    return output_filepath
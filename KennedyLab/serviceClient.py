@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+
+# Client of analysisService.py. Only the standard library is imported, so scripts that hand
+# their runs to the service start in milliseconds instead of loading pandas and NumPy.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# a job is finished once it is in one of these states
+FINISHED_STATES = ("done", "failed")
+
+class ServiceError(Exception):
+    pass
+
+class ServiceClient:
+
+    def __init__(self, url: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout: float = 10.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: dict | None = None, timeout: float | None = None) -> dict:
+        data = None if body is None else json.dumps(body).encode()
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e)["error"]
+            except (ValueError, KeyError):
+                message = e.reason
+            raise ServiceError(f"{method} {path}: {message}") from None
+        except urllib.error.URLError as e:
+            raise ServiceError(f"no analysis service at {self.url} ({e.reason})") from None
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    # Queue one run; job takes the arguments of batch.analyze_file (filepath, num_rows, num_cols,
+    # num_droplets, marker_present, output_dir, output_format, ...). Returns the job's status.
+    def submit(self, **job) -> dict:
+        if "filepath" in job:
+            # the service may run in another directory
+            job["filepath"] = os.path.abspath(job["filepath"])
+        return self._request("POST", "/jobs", job)
+
+    # status of a job; with wait the service holds the reply until the job finishes or wait seconds pass
+    def status(self, job_id: int, wait: float = 0) -> dict:
+        return self._request("GET", f"/jobs/{job_id}?wait={wait}", timeout=self.timeout + wait)
+
+    def jobs(self) -> list[dict]:
+        return self._request("GET", "/jobs")["jobs"]
+
+    # block until the job finishes, or raise ServiceError after timeout seconds
+    def wait(self, job_id: int, timeout: float | None = None, poll: float = 30.0) -> dict:
+        waited = 0.0
+        while True:
+            wait = poll if timeout is None else min(poll, timeout - waited)
+            status = self.status(job_id, wait)
+            if status["state"] in FINISHED_STATES:
+                return status
+            waited += wait
+            if timeout is not None and waited >= timeout:
+                raise ServiceError(f"job {job_id} still {status['state']} after {timeout} s")
+
+    def run(self, **job) -> dict:
+        return self.wait(self.submit(**job)["id"])
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Hand run files to a running analysis service and wait for them.")
+    parser.add_argument("inputs", nargs="+", help="input files")
+    parser.add_argument("--rows", type=int, required=True, help="number of rows on the plate")
+    parser.add_argument("--cols", type=int, required=True, help="number of columns on the plate")
+    parser.add_argument("--droplets", type=int, required=True, help="droplets per sample")
+    parser.add_argument("--marker", action="store_true", help="the runs have a marker channel")
+    parser.add_argument("--output-dir", help="folder for the outputs (default: next to each input)")
+    parser.add_argument("--format", default="xlsx", help="output format")
+    parser.add_argument("--columns", nargs="+", metavar="COLUMN", help="output columns to write (default: all)")
+    parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", help="address of the service")
+    args = parser.parse_args(argv)
+
+    client = ServiceClient(args.url)
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else None
+    try:
+        submitted = [client.submit(filepath=filepath, marker_present=args.marker, num_rows=args.rows,
+                                   num_cols=args.cols, num_droplets=args.droplets, output_dir=output_dir,
+                                   output_format=args.format, columns=args.columns) for filepath in args.inputs]
+        finished = [client.wait(job["id"]) for job in submitted]
+    except ServiceError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for job in finished:
+        result = job["result"]
+        if job["state"] == "done":
+            print(f"{result['file']}: {result['peaks']} peaks, {result['irregulars']} irregular, "
+                  f"{result['seconds']:.2f} s -> {result['output']}")
+        else:
+            print(f"{result['file']}: {result['error']}", file=sys.stderr)
+    return 1 if any(job["state"] != "done" for job in finished) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
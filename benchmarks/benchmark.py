@@ -0,0 +1,195 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from syntheticData import generate_trace, write_trace, samples_per_plate
+
+# Times every DataAnalyzer stage for the GeneralUse and KennedyLab variants on synthetic
+# runs of increasing size and saves the results as JSON so runs can be compared:
+#
+#   python benchmark.py --sizes 10000 100000 1000000 --output before.json
+#   python benchmark.py --compare before.json after.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VARIANTS = ["GeneralUse", "KennedyLab"]
+
+# import a variant's dataAnalyzer; both variants use the same module names, so the
+# previous variant's modules are dropped from sys.modules first
+def load_variant(variant: str):
+    folder = os.path.join(REPO_ROOT, variant)
+    for name, module in list(sys.modules.items()):
+        if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "")) in \
+                [os.path.join(REPO_ROOT, v) for v in VARIANTS]:
+            del sys.modules[name]
+    sys.path.insert(0, folder)
+    try:
+        return importlib.import_module("dataAnalyzer")
+    finally:
+        sys.path.remove(folder)
+
+# (name, function) for every stage of one run, in pipeline order
+def pipeline_stages(module, variant: str, da, data: dict, input_path: str | None, plate: tuple,
+                    out_dir: str, output_format: str) -> list:
+    num_rows, num_cols, num_droplets = plate
+    stages = []
+    if input_path is not None:
+        stages.append(("read", lambda: da.read_data(input_path)))
+    else:
+        # too big for an xlsx round trip, hand the arrays over directly and leave read untimed
+        da._set_columns(dict(data))
+    stages.append(("peaks", lambda: da.process_peaks(True)))
+    stages.append(("irregulars", da.find_irregulars))
+    if variant == "KennedyLab":
+        stages.append(("calibrate", da.calibrate_data))
+    stages.append(("wells", lambda: da.create_well_list(num_rows, num_cols, num_droplets)))
+    if variant == "KennedyLab":
+        stages.append(("write", lambda: da.write_data(None, out_dir, "benchmark", output_format)))
+        stages.append(("heatmap", lambda: da.create_heatmap_array(num_rows, num_cols, num_droplets)))
+    else:
+        stages.append(("write", lambda: da.write_data(out_dir, "benchmark", output_format)))
+        stages.append(("heatmap", lambda: da.create_heatmap_array(num_rows, num_cols, num_droplets, "Isomer 57")))
+    return stages
+
+# run the pipeline once, returning seconds per stage, or peak traced bytes per stage with trace_memory
+def run_pipeline(module, variant: str, engine: str, data: dict, input_path: str | None, plate: tuple,
+                 out_dir: str, output_format: str, trace_memory: bool,
+                 intensity_dtype: str = "float64") -> tuple[dict, object]:
+    da = module.DataAnalyzer(engine=engine, intensity_dtype=intensity_dtype)
+    measured = {}
+    for name, run_stage in pipeline_stages(module, variant, da, data, input_path, plate, out_dir, output_format):
+        if trace_memory:
+            tracemalloc.start()
+            run_stage()
+            measured[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            run_stage()
+            measured[name] = time.perf_counter() - start
+    return measured, da
+
+def benchmark_size(module, variant: str, engine: str, num_samples: int, args) -> dict:
+    per_plate = samples_per_plate(args.rows, args.cols, args.droplets, args.peak_width, args.gap_width)
+    num_plates = max(1, round(num_samples / per_plate))
+    data = generate_trace(args.rows, args.cols, args.droplets, num_plates, args.peak_width, args.gap_width,
+                          args.noise, args.isomers, args.split_rate, args.merge_rate, seed=args.seed)
+    samples = data["Time (min)"].size
+    plate = (args.rows, args.cols, args.droplets)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        input_path = None
+        if samples <= args.max_xlsx_rows:
+            input_path = os.path.join(out_dir, "input.xlsx")
+            write_trace(data, input_path)
+        seconds, da = run_pipeline(module, variant, engine, data, input_path, plate, out_dir, args.format, False,
+                                   args.intensity_dtype)
+        memory = {}
+        if not args.no_memory:
+            memory, _ = run_pipeline(module, variant, engine, data, input_path, plate, out_dir, args.format, True,
+                                     args.intensity_dtype)
+
+    peaks = len(da.peaks)
+    stages = {}
+    for name, stage_seconds in seconds.items():
+        stages[name] = {
+            "seconds": stage_seconds,
+            "samples_per_s": samples / stage_seconds if stage_seconds else None,
+            "peaks_per_s": peaks / stage_seconds if stage_seconds else None,
+            "peak_bytes": memory.get(name),
+        }
+    return {"variant": variant, "engine": engine, "intensity_dtype": args.intensity_dtype,
+            "samples": samples, "peaks": peaks,
+            "read_from_xlsx": input_path is not None, "stages": stages,
+            "total_seconds": sum(seconds.values())}
+
+def print_result(result: dict) -> None:
+    print(f"\n{result['variant']} ({result['engine']}): {result['samples']:,} samples, {result['peaks']:,} peaks"
+          + ("" if result["read_from_xlsx"] else " (read not timed, arrays passed in)"))
+    print(f"  {'stage':<11} {'seconds':>9} {'samples/s':>13} {'peaks/s':>12} {'peak MiB':>9}")
+    for name, stage in result["stages"].items():
+        samples_rate = f"{stage['samples_per_s']:,.0f}" if stage["samples_per_s"] else "-"
+        peaks_rate = f"{stage['peaks_per_s']:,.0f}" if stage["peaks_per_s"] else "-"
+        mem = "-" if stage["peak_bytes"] is None else f"{stage['peak_bytes'] / 2 ** 20:.1f}"
+        print(f"  {name:<11} {stage['seconds']:>9.4f} {samples_rate:>13} {peaks_rate:>12} {mem:>9}")
+
+# stage time ratios between two saved runs, matched on variant, engine and samples
+def compare(before_path: str, after_path: str) -> None:
+    with open(before_path) as f:
+        before = {(r["variant"], r["engine"], r["samples"]): r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = json.load(f)["results"]
+    for result in after:
+        old = before.get((result["variant"], result["engine"], result["samples"]))
+        if old is None:
+            continue
+        print(f"\n{result['variant']} ({result['engine']}), {result['samples']:,} samples")
+        print(f"  {'stage':<11} {'before s':>10} {'after s':>10} {'speedup':>8}")
+        for name, stage in result["stages"].items():
+            if name not in old["stages"]:
+                continue
+            old_seconds = old["stages"][name]["seconds"]
+            speedup = old_seconds / stage["seconds"] if stage["seconds"] else float("inf")
+            print(f"  {name:<11} {old_seconds:>10.4f} {stage['seconds']:>10.4f} {speedup:>7.2f}x")
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the DataAnalyzer pipeline on synthetic runs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000],
+                        help="approximate samples per run")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    parser.add_argument("--engines", nargs="+", default=["numpy"], help="DataAnalyzer engines to time")
+    parser.add_argument("--rows", type=int, default=8)
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--droplets", type=int, default=3)
+    parser.add_argument("--peak-width", type=int, default=20, help="samples per droplet")
+    parser.add_argument("--gap-width", type=int, default=15, help="samples between droplets")
+    parser.add_argument("--noise", type=float, default=0.05, help="relative noise on every channel")
+    parser.add_argument("--isomers", type=int, default=2)
+    parser.add_argument("--split-rate", type=float, default=0.01)
+    parser.add_argument("--merge-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--intensity-dtype", choices=["float64", "float32"], default="float64",
+                        help="how the analyzer stores intensities")
+    parser.add_argument("--format", default="xlsx", help="output format for the write stage")
+    parser.add_argument("--max-xlsx-rows", type=int, default=200_000,
+                        help="largest run that is written to xlsx so the read stage can be timed")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two saved runs")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    results = []
+    for variant in args.variants:
+        module = load_variant(variant)
+        for engine in args.engines:
+            for size in args.sizes:
+                result = benchmark_size(module, variant, engine, size, args)
+                print_result(result)
+                results.append(result)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nsaved {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import sys
+import numpy as np
+from dataclasses import fields
+from benchmark import VARIANTS, load_variant
+from syntheticData import generate_trace
+
+# Checks that every DataAnalyzer engine finds the same peaks, totals, irregular droplets and
+# wells as the reference "python" engine on synthetic runs. Exits 1 on any mismatch:
+#
+#   python parity.py --engines numpy numba parallel
+
+# (name, generate_trace arguments, whether a marker is present, intensity dtype) of every case
+CASES = [
+    ("one plate", dict(num_plates=1), True, "float64"),
+    ("no marker", dict(num_plates=2, marker=False), False, "float64"),
+    ("irregular droplets", dict(num_plates=3, split_rate=0.1, merge_rate=0.1, seed=3), True, "float64"),
+    ("nan samples", dict(num_plates=2, seed=5), True, "float64"),
+    ("float32 intensities", dict(num_plates=2, seed=7), True, "float32"),
+]
+
+def analyze(module, engine: str, data: dict, marker_present: bool, intensity_dtype: str, plate: tuple):
+    da = module.DataAnalyzer(engine=engine, intensity_dtype=intensity_dtype, workers=4)
+    da._set_columns(dict(data))
+    da.process_peaks(marker_present)
+    da.find_irregulars()
+    da.create_well_list(*plate)
+    return da
+
+# names of the fields of two runs that differ, float fields within rtol
+def differences(reference, other, rtol: float) -> list[str]:
+    differ = []
+    for field in fields(reference.peaks):
+        if field.name == "isomer_columns":
+            continue
+        expected = getattr(reference.peaks, field.name)
+        actual = getattr(other.peaks, field.name)
+        if expected.shape != actual.shape:
+            differ.append(f"{field.name} shape {actual.shape} != {expected.shape}")
+        elif expected.dtype.kind == "f":
+            if not np.allclose(actual, expected, rtol=rtol, atol=0, equal_nan=True):
+                differ.append(field.name)
+        elif not np.array_equal(actual, expected):
+            differ.append(field.name)
+    if reference.num_durations != other.num_durations or \
+            not np.isclose(reference.total_duration, other.total_duration, rtol=rtol, atol=0):
+        differ.append("durations total")
+    for name in ("potential_merged", "potential_split"):
+        if not np.array_equal(getattr(reference, name), getattr(other, name)):
+            differ.append(name)
+    if not np.array_equal(reference.well_list, other.well_list):
+        differ.append("wells")
+    return differ
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare DataAnalyzer engines against the python engine.")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=VARIANTS)
+    parser.add_argument("--engines", nargs="+", default=["numpy", "numba", "parallel"])
+    parser.add_argument("--rtol", type=float, default=1e-9,
+                        help="relative tolerance on float fields, sums may be added in a different order")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    plate = (8, 12, 3)
+    for variant in args.variants:
+        module = load_variant(variant)
+        # small enough to run in seconds, so let the parallel engine split these runs too
+        module.PARALLEL_CHUNK_SAMPLES = 1000
+        for name, trace_args, marker_present, intensity_dtype in CASES:
+            data = generate_trace(*plate, **trace_args)
+            if name == "nan samples":
+                for column in ("IS", "Isomer 57"):
+                    data[column][1000:1030] = np.nan
+            reference = analyze(module, "python", data, marker_present, intensity_dtype, plate)
+            for engine in args.engines:
+                other = analyze(module, engine, data, marker_present, intensity_dtype, plate)
+                differ = differences(reference, other, args.rtol)
+                # an engine that is not available falls back to another one
+                shown = engine if other.engine == engine else f"{engine} ({other.engine})"
+                status = "ok" if not differ else "DIFFERS: " + ", ".join(differ)
+                print(f"{variant:<11} {name:<20} {shown:<16} {len(reference.peaks):>6} peaks  {status}")
+                failures += bool(differ)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
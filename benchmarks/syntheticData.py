@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Synthetic droplet traces shaped like the instrument exports DataAnalyzer reads.
+# Wells are acquired in the order create_well_list expects: last row first, and within
+# a row from the last column down. The droplets of the first well in every row carry a
+# marker pulse. A fraction of droplets are merged (one droplet twice as long) or split
+# (one droplet broken in two by a short gap).
+
+# isomer names, the first two are the ones KennedyLab reads
+def isomer_names(num_isomers: int) -> list[str]:
+    names = ["Isomer 57", "Isomer 77"]
+    return (names + [f"Isomer {100 + i}" for i in range(max(0, num_isomers - 2))])[:num_isomers]
+
+# samples one plate takes on average, used to size a run to a target sample count
+def samples_per_plate(num_rows: int, num_cols: int, num_droplets: int, peak_width: int, gap_width: int) -> int:
+    return num_rows * num_cols * num_droplets * (peak_width + gap_width)
+
+def generate_trace(num_rows: int = 8, num_cols: int = 12, num_droplets: int = 3, num_plates: int = 1,
+                   peak_width: int = 20, gap_width: int = 15, noise: float = 0.05, num_isomers: int = 2,
+                   split_rate: float = 0.01, merge_rate: float = 0.01, marker: bool = True,
+                   time_step: float = 0.0005, seed: int = 0) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    wells_per_plate = num_rows * num_cols
+    num_wells = wells_per_plate * num_plates
+    num_peaks = num_wells * num_droplets
+
+    # acquisition order of wells, the first well of each row is the one with the marker
+    well_in_plate = np.repeat(np.arange(num_wells) % wells_per_plate, num_droplets)
+    row_start = (well_in_plate % num_cols) == 0
+
+    widths = rng.integers(peak_width - peak_width // 4, peak_width + peak_width // 4 + 1, num_peaks)
+    merged = rng.random(num_peaks) < merge_rate
+    split = ~merged & (rng.random(num_peaks) < split_rate)
+    widths[merged] *= 2
+
+    # every droplet is gap, first piece, split gap, second piece; unused pieces have length 0
+    lengths = np.zeros((num_peaks, 4), dtype=np.int64)
+    lengths[:, 0] = gap_width
+    lengths[:, 1] = np.where(split, np.maximum(widths // 2, 1), widths)
+    lengths[:, 2] = np.where(split, max(gap_width // 3, 2), 0)
+    lengths[:, 3] = np.where(split, np.maximum(widths - widths // 2, 1), 0)
+    in_droplet = np.tile(np.array([False, True, False, True]), num_peaks)
+    lengths = lengths.ravel()
+    segment_peak = np.repeat(np.arange(num_peaks), 4)
+
+    # per sample: which droplet it belongs to and whether it is inside it
+    sample_peak = np.repeat(segment_peak, lengths)
+    sample_in_droplet = np.repeat(in_droplet, lengths)
+    # trailing baseline so the last droplet is closed
+    sample_peak = np.concatenate([sample_peak, np.full(gap_width, num_peaks - 1)])
+    sample_in_droplet = np.concatenate([sample_in_droplet, np.zeros(gap_width, dtype=bool)])
+    num_samples = sample_peak.size
+
+    def noisy(values: np.ndarray) -> np.ndarray:
+        return values * (1 + noise * rng.standard_normal(num_samples))
+
+    columns = {"Time (min)": np.arange(num_samples) * time_step}
+    columns["IS"] = noisy(np.where(sample_in_droplet, 100.0, 2.0))
+    if marker:
+        marker_level = np.where(sample_in_droplet & row_start[sample_peak], 50.0, 1.0)
+    else:
+        marker_level = np.ones(num_samples)
+    columns["Marker"] = noisy(marker_level)
+
+    # each well gets its own product level so heatmaps have structure
+    for i, name in enumerate(isomer_names(num_isomers)):
+        well_level = rng.uniform(200, 2000, wells_per_plate) * (i + 1)
+        droplet_level = well_level[well_in_plate]
+        columns[name] = noisy(np.where(sample_in_droplet, droplet_level[sample_peak], 10.0))
+    return columns
+
+def write_trace(columns: dict[str, np.ndarray], filepath: str) -> None:
+    df = pd.DataFrame(columns)
+    if filepath.lower().endswith(".csv"):
+        df.to_csv(filepath, index=False)
+    else:
+        df.to_excel(filepath, index=False)